@@ -0,0 +1,111 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, glob, shutil, time
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from config import config
+from filehandler import FileHandler
+from indexstore import IndexStore
+from renderer import Renderer
+from scratch import scratch, initialize
+
+def render(file, destination):
+    start=time.perf_counter()
+    try:
+        handler=FileHandler(file)
+        handler.open()
+        handler.extract("template/")
+        target=Renderer().render(handler.directory.name)
+        if target is None:
+            raise ValueError("Rendering failed")
+        shutil.copytree(os.path.dirname(target), destination, ignore=shutil.ignore_patterns("index.html", "output.html"), dirs_exist_ok=True)
+        shutil.copyfile(target, os.path.join(destination, "index.html"))
+        return (file, destination, time.perf_counter()-start, None)
+    except Exception as e:
+        return (file, None, time.perf_counter()-start, str(e))
+
+def find():
+    files={}
+    for target in config["target"]:
+        if(os.path.isdir(target)):
+            for file in sorted(glob.glob(os.path.join(target, "**", "*.mpaz"), recursive=True)):
+                files.setdefault(os.path.abspath(file), os.path.relpath(file, target))
+        else:
+            files.setdefault(os.path.abspath(target), None)
+    if(config["query"]):
+        store=IndexStore()
+        where, params=store.compile(config["query"])
+        for row in store.page(where, params, "date", limit=-1):
+            files.setdefault(os.path.abspath(row[IndexStore.columns.index("file")]), None)
+    return files
+
+def destinations(files):
+    names={}
+    used=set()
+    for file, name in files.items():
+        if name is None:
+            name=os.path.relpath(file, config["document_directory"])
+            if(name.startswith(os.pardir)):
+                name=os.path.basename(file)
+        name=os.path.splitext(name)[0]
+        unique=name
+        number=1
+        while(os.path.normcase(unique) in used):
+            number=number+1
+            unique=name+"-"+str(number)
+        used.add(os.path.normcase(unique))
+        names[file]=os.path.join(config["output"], unique)
+    return names
+
+def main():
+    try:
+        files=destinations(find())
+    except ValueError as e:
+        print(e)
+        return 2
+    if(not files):
+        print("No prescription to render")
+        return 2
+    os.makedirs(config["output"], exist_ok=True)
+    jobs=config["jobs"] or os.cpu_count() or 1
+    print("Rendering", len(files), "files with", jobs, "jobs to", config["output"])
+    failed=0
+    rendered=[]
+    start=time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn"), initializer=initialize, initargs=(scratch.path(),)) as executor:
+        chunksize=max(1, min(16, len(files)//(jobs*4)))
+        for file, destination, elapsed, error in executor.map(render, list(files), list(files.values()), chunksize=chunksize):
+            if error is None:
+                rendered.append((os.path.join(destination, "index.html"), destination+".pdf"))
+                print("{:8.1f} ms  {} -> {}".format(elapsed*1000, file, destination), flush=True)
+            else:
+                failed=failed+1
+                logging.error(file+": "+error)
+    elapsed=time.perf_counter()-start
+    print("Rendered", len(files)-failed, "files,", failed, "failed")
+    print("Time {:.2f} s, {:.1f} files/s".format(elapsed, len(files)/elapsed if elapsed else 0))
+    if(config["pdf"] and rendered):
+        from pdfexport import export
+        print("Exporting", len(rendered), "files to PDF with", jobs, "pages")
+        start=time.perf_counter()
+        try:
+            errors=export(rendered, jobs, config["page"], report)
+        except KeyError:
+            print("Unknown page size", config["page"])
+            return 2
+        elapsed=time.perf_counter()-start
+        print("Exported", len(rendered)-len(errors), "files,", len(errors), "failed")
+        print("Time {:.2f} s, {:.1f} files/s".format(elapsed, len(rendered)/elapsed if elapsed else 0))
+        failed=failed+len(errors)
+    return 1 if failed else 0
+
+def report(source, target, ok, elapsed):
+    if(ok):
+        print("{:8.1f} ms  {} -> {}".format(elapsed*1000, source, target), flush=True)
+    else:
+        logging.error(source+": PDF export failed")
@@ -0,0 +1,72 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import os, glob, time, tempfile, tracemalloc
+from config import config
+from filehandler import FileHandler
+from indexstore import IndexStore
+from indextable import IndexTable
+
+policies=[("stored", None), ("deflated", 1), ("deflated", 6), ("deflated", 9), ("auto", 1), ("auto", 6), ("auto", 9)]
+sample=100
+row_target=256
+
+def run(files, policy, level, directory):
+    config["compression"]=policy
+    config["compression_level"]=level
+    size=0
+    save_time=0
+    open_time=0
+    for i in files:
+        handler=FileHandler(i)
+        handler.open()
+        handler.extract()
+        target=os.path.join(directory, os.path.basename(i))
+        start=time.perf_counter()
+        handler.save(target, change_template=False)
+        save_time=save_time+time.perf_counter()-start
+        size=size+os.path.getsize(target)
+        start=time.perf_counter()
+        handler=FileHandler(target)
+        handler.open()
+        handler.extract()
+        open_time=open_time+time.perf_counter()-start
+    return (size, save_time, open_time)
+
+def table():
+    rows=IndexStore().page(limit=-1)
+    if(not rows):
+        return
+    tracemalloc.start()
+    start=tracemalloc.get_traced_memory()[0]
+    index=IndexTable(len(IndexStore.columns))
+    index.extend(rows)
+    size=tracemalloc.get_traced_memory()[0]-start
+    tracemalloc.stop()
+    print("Index table {} rows, {:.0f} bytes/row (target {})".format(len(index), size/len(rows), row_target))
+
+def main():
+    if(config["filename"]):
+        corpus=config["filename"]
+    else:
+        corpus=config["document_directory"]
+    files=sorted(glob.glob(os.path.join(corpus, "*.mpaz")))[:sample]
+    if(not files):
+        print("No prescription found in "+corpus)
+        return
+    config["attachment_store"]=False
+    config["template_store"]=False
+    print("Benchmarking", len(files), "files from", corpus)
+    print("{:<10} {:>5} {:>12} {:>10} {:>10}".format("Policy", "Level", "Size (KiB)", "Save (ms)", "Open (ms)"))
+    for policy, level in policies:
+        with tempfile.TemporaryDirectory() as directory:
+            size, save_time, open_time=run(files, policy, level, directory)
+        print("{:<10} {:>5} {:>12.1f} {:>10.2f} {:>10.2f}".format(policy, "-" if level is None else level, size/1024, save_time*1000/len(files), open_time*1000/len(files)))
+    table()
+
+if __name__=="__main__":
+    main()
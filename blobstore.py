@@ -0,0 +1,90 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import os, shutil, glob, hashlib, tempfile, time
+from collections import OrderedDict
+from config import config
+
+class BlobStore():
+
+    digests=OrderedDict()
+    cache_size=4096
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory=config["store_directory"]
+        self.directory=directory
+
+    def digest(file):
+        stat=os.stat(file)
+        key=(os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+        if key in BlobStore.digests:
+            BlobStore.digests.move_to_end(key)
+            return BlobStore.digests[key]
+        digest=hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1<<20), b""):
+                digest.update(block)
+        BlobStore.digests[key]=digest.hexdigest()
+        while(len(BlobStore.digests)>BlobStore.cache_size):
+            BlobStore.digests.popitem(last=False)
+        return BlobStore.digests[key]
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, file):
+        digest=BlobStore.digest(file)
+        target=self.path(digest)
+        if os.path.exists(target):
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, temp=tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            os.close(fd)
+            try:
+                shutil.copyfile(file, temp)
+                os.replace(temp, target)
+            except Exception:
+                os.remove(temp)
+                raise
+        return digest
+
+    def put_directory(self, directory, prefix=""):
+        references={}
+        for f in glob.glob(os.path.join(directory, "**", "*"), recursive=True):
+            if(os.path.isfile(f)):
+                references[prefix+os.path.relpath(f, directory).replace(os.sep, "/")]=self.put(f)
+        return references
+
+    def sweep(self, referenced, age=3600):
+        removed=0
+        size=0
+        limit=time.time()-age
+        for path in glob.glob(os.path.join(self.directory, "??", "*")):
+            digest=os.path.basename(os.path.dirname(path))+os.path.basename(path)
+            if(digest in referenced or path.endswith(".tmp")):
+                continue
+            try:
+                stat=os.stat(path)
+                if(stat.st_mtime>limit):
+                    continue
+                os.remove(path)
+                removed=removed+1
+                size=size+stat.st_size
+            except OSError:
+                pass
+        return (removed, size)
+
+    def get(self, digest):
+        path=self.path(digest)
+        if not os.path.exists(path):
+            raise FileNotFoundError("Blob "+digest+" not found in "+self.directory)
+        return path
@@ -0,0 +1,77 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, json, copy, threading
+from collections import OrderedDict
+from zipfile import ZipFile
+
+class PrescriptionCache():
+
+    def __init__(self, size=256):
+        self.size=size
+        self.items=OrderedDict()
+        self.keys={}
+        self.pending=[]
+        self.thread=None
+        self.lock=threading.Lock()
+
+    def key(file):
+        stat=os.stat(file)
+        return (os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+
+    def read(file):
+        with ZipFile(file) as zf:
+            with zf.open("prescription.json") as pf:
+                return json.loads(pf.read())
+
+    def load(self, file):
+        key=PrescriptionCache.key(file)
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+        data=PrescriptionCache.read(file)
+        with self.lock:
+            old=self.keys.get(key[0])
+            if old is not None and old!=key:
+                self.items.pop(old, None)
+            self.items[key]=data
+            self.keys[key[0]]=key
+            while(len(self.items)>self.size):
+                old=self.items.popitem(last=False)[0]
+                if(self.keys.get(old[0])==old):
+                    del self.keys[old[0]]
+        return data
+
+    def get(self, file):
+        return copy.deepcopy(self.load(file))
+
+    def prefetch(self, files):
+        with self.lock:
+            self.pending=list(files)
+            if self.thread is None:
+                self.thread=threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if(not self.pending):
+                    self.thread=None
+                    return
+                file=self.pending.pop(0)
+            try:
+                self.load(file)
+            except Exception as e:
+                logging.warning(e)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.keys.clear()
+
+cache=PrescriptionCache()
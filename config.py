@@ -14,11 +14,36 @@ real_dir=os.path.dirname(os.path.realpath(sys.argv[0]))
 with open(os.path.join(real_dir, "info.json")) as info_file:
     info=json.loads(info_file.read())
 
+commands=["repack", "render"]
+
+if(len(sys.argv)>1 and sys.argv[1] in commands):
+    command=sys.argv[1]
+else:
+    command=None
+
 parser = argparse.ArgumentParser()
-parser.add_argument("filename", nargs="?")
+if command is None:
+    parser.add_argument("filename", nargs="?")
+else:
+    parser.prog=parser.prog+" "+command
+    parser.add_argument("target", nargs="*")
+    parser.add_argument("-j", "--jobs", type=int)
+    if(command=="repack"):
+        parser.add_argument("--compression", choices=["auto", "deflated", "stored"])
+        parser.add_argument("--level", type=int, choices=range(0, 10))
+        parser.add_argument("--sweep", action="store_true")
+        parser.add_argument("--scan", action="append", default=[])
+    elif(command=="render"):
+        parser.add_argument("-q", "--query")
+        parser.add_argument("-o", "--output", default=".")
+        parser.add_argument("--pdf", action="store_true")
+        parser.add_argument("--page", default="A4")
 parser.add_argument("-c", "--config")
 parser.add_argument("-p", "--prescriber")
-args = parser.parse_args()
+if command is None:
+    args = parser.parse_args()
+else:
+    args = parser.parse_args(sys.argv[2:])
 
 if(args.config is None):
     config_file=default_config_file
@@ -39,6 +64,15 @@ default = {
         "plugin_directory": "plugin",
         "enable_plugin": True,
         "log_directory": "log",
+        "index_file": "index.db",
+        "store_directory": "store",
+        "cache_directory": "cache",
+        "attachment_store": False,
+        "template_store": False,
+        "compression": "auto",
+        "compression_level": 6,
+        "scratch_tmpfs": False,
+        "scratch_quota": 0,
         "preset_newline": True,
         "preset_delimiter": ",",
         "markdown": False,
@@ -61,7 +95,25 @@ except Exception as e:
     config=default
 
 config_orig=copy.deepcopy(config)
-config["filename"]=args.filename
+config["command"]=command
+if command is None:
+    config["filename"]=args.filename
+else:
+    config["filename"]=None
+    config["target"]=args.target
+    config["jobs"]=args.jobs
+    if(command=="repack"):
+        if args.compression is not None:
+            config["compression"]=args.compression
+        if args.level is not None:
+            config["compression_level"]=args.level
+        config["sweep"]=args.sweep
+        config["scan"]=[os.path.abspath(i) for i in args.scan]
+    elif(command=="render"):
+        config["query"]=args.query
+        config["output"]=os.path.abspath(args.output)
+        config["pdf"]=args.pdf
+        config["page"]=args.page
 config["data_directory"]=os.path.abspath(os.path.join(real_dir, os.path.expanduser(config["data_directory"])))
 config["document_directory"]=os.path.join(config["data_directory"], config["document_directory"])
 config["preset_directory"]=os.path.join(config["data_directory"], config["preset_directory"])
@@ -70,6 +122,9 @@ config["plugin_directory"]=os.path.join(config["data_directory"], config["plugin
 config["template_directory"]=os.path.join(config["data_directory"], config["template_directory"])
 config["template"]=os.path.join(config["template_directory"], config["template"])
 config["log_directory"]=os.path.join(config["data_directory"], config["log_directory"])
+config["index_file"]=os.path.join(config["data_directory"], config["index_file"])
+config["store_directory"]=os.path.join(config["data_directory"], config["store_directory"])
+config["cache_directory"]=os.path.join(config["data_directory"], config["cache_directory"])
 config["resource"]=os.path.abspath(os.path.join(real_dir, "resource"))
 if(args.prescriber is None):
     config["prescriber_directory"]=os.path.join(config["data_directory"], config["prescriber_directory"])
@@ -92,6 +147,8 @@ os.makedirs(config["form_directory"], exist_ok=True)
 os.makedirs(config["plugin_directory"], exist_ok=True)
 os.makedirs(config["template_directory"], exist_ok=True)
 os.makedirs(config["log_directory"], exist_ok=True)
+os.makedirs(config["store_directory"], exist_ok=True)
+os.makedirs(config["cache_directory"], exist_ok=True)
 if not os.path.exists(os.path.join(config["data_directory"], "config.json")):
     shutil.copyfile(os.path.abspath(os.path.join(real_dir, "data", "config.json")), os.path.join(config["data_directory"], "config.json"))
 if not os.path.exists(os.path.join(config["prescriber_directory"], "prescriber.json")):
@@ -5,10 +5,13 @@
 # MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
 
-import logging, os, shutil, glob, tempfile, json
+import logging, os, sys, shutil, glob, json, copy, struct, zipfile
 from zipfile import ZipFile
 from config import config
 from signature import Signature
+from indexstore import IndexStore
+from blobstore import BlobStore
+from scratch import scratch
 
 class FileHandler():
 
@@ -16,13 +19,26 @@ class FileHandler():
 
     file=""
     directory=""
+    source=""
+    pending=set()
+    references={}
+    lazy=["attachment/", "template/"]
+    compressed=[".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf", ".zip", ".mpaz", ".gz", ".bz2", ".xz", ".7z", ".mp3", ".mp4", ".docx", ".xlsx", ".pptx", ".odt", ".ods"]
+    minimum=256
+    raw_copy=sys.version_info<(3, 14) and all(hasattr(zipfile, i) for i in ["structFileHeader", "sizeFileHeader", "_FH_FILENAME_LENGTH", "_FH_EXTRA_FIELD_LENGTH", "_strip_extra"])
 
     def __init__(self, file=""):
         self.reset(file)
 
     def reset(self, file=""):
+        directory=scratch.get()
+        if(self.directory):
+            self.directory.cleanup()
+        self.directory=directory
         self.file=file
-        self.directory=tempfile.TemporaryDirectory()
+        self.source=""
+        self.pending=set()
+        self.references={}
 
     def set_file(self, file):
         self.file=file
@@ -30,6 +46,8 @@ class FileHandler():
     def copy(self, file, category="attachment"):
         dirname=os.path.join(self.directory.name, category)
         os.makedirs(dirname, exist_ok=True)
+        if(self.member(file) in self.pending or self.member(file) in self.references):
+            return
         try:
             shutil.copyfile(file, os.path.join(dirname, os.path.basename(file)))
         except shutil.SameFileError as e:
@@ -40,32 +58,185 @@ class FileHandler():
         dirname=os.path.join(self.directory.name, category)
         for f in glob.glob(os.path.join(dirname,"*"), recursive=True):
             items.append(f)
+        for i in sorted(self.pending|set(self.references)):
+            if(i.startswith(category+"/")):
+                items.append(os.path.join(self.directory.name, *i.split("/")))
         return(items)
 
-    def save(self, file=None, change_template=True):
+    def member(self, file):
+        file=os.path.abspath(file)
+        directory=os.path.abspath(self.directory.name)
+        try:
+            if(os.path.commonpath([file, directory])!=directory):
+                return None
+        except ValueError:
+            return None
+        return os.path.relpath(file, directory).replace(os.sep, "/")
+
+    def extract(self, prefix=""):
+        members=[i for i in self.pending if i.startswith(prefix)]
+        if(members):
+            with ZipFile(self.source, "r", strict_timestamps=False) as source:
+                source.extractall(self.directory.name, members)
+            self.pending.difference_update(members)
+        for name in [i for i in self.references if i.startswith(prefix)]:
+            target=os.path.join(self.directory.name, *name.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(BlobStore().get(self.references[name]), target)
+            del self.references[name]
+
+    def fetch(self, file):
+        if(self.member(file) in self.pending or self.member(file) in self.references):
+            self.extract(self.member(file))
+        return file
+
+    def save(self, file=None, change_template=True, progress=None):
         if file is not None:
             self.file=file
         with open(os.path.join(self.directory.name, "meta.json"), "w") as f:
             f.write(json.dumps(self.meta))
         template=os.path.join(self.directory.name, "template")
         os.makedirs(template, exist_ok=True)
-        if(change_template):
+        if(change_template and config["template_store"]):
+            shutil.rmtree(template)
+            os.makedirs(template)
+            self.pending={i for i in self.pending if not i.startswith("template/")}
+            self.references={i: j for i, j in self.references.items() if not i.startswith("template/")}
+            self.references.update(BlobStore().put_directory(config["template"], "template/"))
+        elif(change_template):
             shutil.copytree(config["template"], template, dirs_exist_ok=True)
         else:
             try:
                 os.remove(os.path.join(template, "output.html"))
             except:
                 pass
+            self.pending.discard("template/output.html")
+        self.references=self.write(self.file, progress=progress)
+        self.source=self.file
+
+    def export(self, file, progress=None):
+        self.write(file, embed=True, progress=progress)
+
+    def write(self, file, embed=False, progress=None):
+        self.pending={i for i in self.pending if not os.path.exists(os.path.join(self.directory.name, *i.split("/")))}
+        references={i: j for i, j in self.references.items() if not os.path.exists(os.path.join(self.directory.name, *i.split("/")))}
+        files=glob.glob(os.path.join(self.directory.name, "**" ,"*"), recursive=True)
+        stored=[]
+        if(not embed):
+            for f in files:
+                name=os.path.relpath(f, self.directory.name).replace(os.sep, "/")
+                if(self.shared(name) and os.path.isfile(f)):
+                    references[name]=BlobStore().put(f)
+                    stored.append(f)
+            files=[f for f in files if f not in stored]
+        temp=file+".tmp"
+        try:
+            total=len(self.pending)+len(files)+len(references)
+            done=0
+            with ZipFile(temp, "w", strict_timestamps=False) as target:
+                if(self.pending):
+                    with ZipFile(self.source, "r") as source:
+                        for name in sorted(self.pending):
+                            self.copy_member(source, target, name)
+                            done=done+1
+                            if progress is not None:
+                                progress(done, total)
+                for f in files:
+                    target.write(f, os.path.relpath(f, self.directory.name), *self.compression(f, os.path.getsize(f)))
+                    done=done+1
+                    if progress is not None:
+                        progress(done, total)
+                for name, digest in sorted(references.items()):
+                    if(embed or (not self.shared(name) and BlobStore().has(digest))):
+                        target.write(BlobStore().get(digest), name, *self.compression(name, os.path.getsize(BlobStore().get(digest))))
+                        del references[name]
+                    done=done+1
+                    if progress is not None:
+                        progress(done, total)
+                if(references):
+                    data=json.dumps(references, indent=4)
+                    target.writestr("reference.json", data, *self.compression("reference.json", len(data)))
+                try:
+                    target.comment=IndexStore.summary(os.path.join(self.directory.name, "prescription.json"))
+                except Exception as e:
+                    logging.warning(e)
+            if(os.path.exists(file)):
+                shutil.copymode(file, temp)
+            os.replace(temp, file)
+        except Exception:
+            if(os.path.exists(temp)):
+                os.remove(temp)
+            raise
+        for f in stored:
+            os.remove(f)
+        return references
+
+    def compression(self, name, size):
+        if(config["compression"]=="deflated" or (config["compression"]=="auto" and size>=self.minimum and os.path.splitext(name)[1].lower() not in self.compressed)):
+            return (zipfile.ZIP_DEFLATED, config["compression_level"])
+        else:
+            return (zipfile.ZIP_STORED, None)
+
+    def shared(self, name):
+        if(name.startswith("attachment/")):
+            return config["attachment_store"]
+        elif(name.startswith("template/")):
+            return config["template_store"]
+        else:
+            return False
+
+    def copy_member(self, source, target, name):
+        info=source.getinfo(name)
+        if(self.raw_copy):
+            try:
+                self.copy_raw(source, target, info)
+                return
+            except Exception as e:
+                logging.warning("Copying "+name+" by extracting it: "+str(e))
+        member=zipfile.ZipInfo(info.filename, info.date_time)
+        member.external_attr=info.external_attr
+        target.writestr(member, source.read(info), *self.compression(name, info.file_size))
 
-        with ZipFile(self.file, "w", strict_timestamps=False) as target:
-            for f in glob.glob(os.path.join(self.directory.name, "**" ,"*"), recursive=True):
-                target.write(f, os.path.relpath(f, self.directory.name))
+    def copy_raw(self, source, target, info):
+        # zipfile has no public way to copy a member without recompressing it, so
+        # the compressed data is copied using its header internals. raw_copy limits
+        # this to the versions where they are known, and copy_member falls back to
+        # extracting the member if they do not match. Nothing is added to the
+        # target until the copy is complete and the next member is written at
+        # start_dir, so a failed copy is simply overwritten.
+        source.fp.seek(info.header_offset)
+        header=struct.unpack(zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader))
+        source.fp.seek(info.header_offset+zipfile.sizeFileHeader+header[zipfile._FH_FILENAME_LENGTH]+header[zipfile._FH_EXTRA_FIELD_LENGTH])
+        member=copy.copy(info)
+        member.flag_bits=member.flag_bits&~0x08
+        member.extra=zipfile._strip_extra(member.extra, (1,))
+        member.header_offset=target.fp.tell()
+        target.fp.write(member.FileHeader(member.file_size>zipfile.ZIP64_LIMIT or member.compress_size>zipfile.ZIP64_LIMIT))
+        remaining=info.compress_size
+        while(remaining>0):
+            data=source.fp.read(min(remaining, 1<<20))
+            if(not data):
+                raise EOFError("Truncated member "+info.filename)
+            target.fp.write(data)
+            remaining=remaining-len(data)
+        target.filelist.append(member)
+        target.NameToInfo[member.filename]=member
+        target.start_dir=target.fp.tell()
 
-    def open(self, file=None):
+    def open(self, file=None, progress=None):
         if file is not None:
             self.file=file
+        self.source=self.file
         with ZipFile(self.file, "r", strict_timestamps=False) as source:
-            source.extractall(self.directory.name)
+            members=source.namelist()
+            self.pending={i for i in members if not i.endswith("/") and i.startswith(tuple(self.lazy))}
+            if("reference.json" in members):
+                self.references=json.loads(source.read("reference.json"))
+            members=[i for i in members if i not in self.pending and i!="reference.json"]
+            for done, member in enumerate(members, 1):
+                source.extract(member, self.directory.name)
+                if progress is not None:
+                    progress(done, len(members))
 
     def sign(self, password=""):
         with open(os.path.join(self.directory.name, "prescription.json"), "r") as file:
@@ -89,6 +260,10 @@ class FileHandler():
 
     def delete_attachment(self, item):
         try:
+            if("attachment/"+os.path.basename(item) in self.pending or "attachment/"+os.path.basename(item) in self.references):
+                self.pending.discard("attachment/"+os.path.basename(item))
+                self.references.pop("attachment/"+os.path.basename(item), None)
+                return
             os.unlink(os.path.join(self.directory.name, "attachment", os.path.basename(item)))
         except Exception as e:
             logging.exception(e)
@@ -101,7 +276,7 @@ class FileHandler():
             logging.exception(e)
 
     def has_template(self):
-        return(os.path.exists(os.path.join(self.directory.name, "template", "index.html")))
+        return(os.path.exists(os.path.join(self.directory.name, "template", "index.html")) or "template/index.html" in self.pending or "template/index.html" in self.references)
 
     def is_signed(self):
         return(os.path.exists(os.path.join(self.directory.name, "certificate.pem")) and (os.path.exists(os.path.join(self.directory.name, "signature.p7m"))))
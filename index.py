@@ -5,23 +5,28 @@
 # MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
 
-from PyQt6.QtWidgets import QWidget, QMainWindow, QFormLayout, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QTableView, QAbstractItemView, QFileDialog
-from PyQt6.QtGui import QIcon, QStandardItemModel, QStandardItem
-from PyQt6.QtCore import Qt, pyqtSignal, QSortFilterProxyModel, QThread
+from PyQt6.QtWidgets import QWidget, QMainWindow, QFormLayout, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QTableView, QAbstractItemView, QFileDialog, QStatusBar, QCheckBox, QDateEdit, QLabel, QProgressBar
+from PyQt6.QtGui import QIcon
+from PyQt6.QtCore import Qt, pyqtSignal, QAbstractTableModel, QModelIndex, QThread, QDate
 from glob import glob
-from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from config import config
 from renderbox import UnrenderBox
-import logging, os, json
+from indexstore import IndexStore
+from indextable import IndexTable
+from cache import cache
+import logging, os, time, threading, datetime
 
 class Index(QMainWindow):
 
     signal_open=pyqtSignal(str)
     signal_copy=pyqtSignal(dict)
-    index={}
-    proxymodel=QSortFilterProxyModel()
+    signal_change=pyqtSignal()
+
+    prefetch_size=5
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -39,14 +44,38 @@ class Index(QMainWindow):
         self.table.doubleClicked.connect(self.cmd_view)
         layout2=QFormLayout()
         self.input_pid=QLineEdit()
-        self.input_pid.returnPressed.connect(self.cmd_filter_pid)
+        self.input_pid.returnPressed.connect(self.cmd_filter)
         self.input_id=QLineEdit()
-        self.input_id.returnPressed.connect(self.cmd_filter_id)
+        self.input_id.returnPressed.connect(self.cmd_filter)
         self.input_name=QLineEdit()
-        self.input_name.returnPressed.connect(self.cmd_filter_name)
+        self.input_name.returnPressed.connect(self.cmd_filter)
+        self.input_query=QLineEdit()
+        self.input_query.setPlaceholderText("e.g. sex:F date>=2024-01-01 diagnosis:\"type 2 diabetes\" methotrexate")
+        self.input_query.returnPressed.connect(self.cmd_filter)
+        self.input_relevance=QCheckBox("Sort by relevance")
+        self.input_relevance.toggled.connect(self.cmd_filter)
+        layout_query=QHBoxLayout()
+        layout_query.addWidget(self.input_query)
+        layout_query.addWidget(self.input_relevance)
         layout2.addRow("Filter by PID:", self.input_pid)
         layout2.addRow("Filter by ID:", self.input_id)
         layout2.addRow("Filter by Name:", self.input_name)
+        layout2.addRow("Query:", layout_query)
+        layout_date=QHBoxLayout()
+        self.input_date=QCheckBox("Only from")
+        self.input_date.toggled.connect(self.cmd_filter)
+        self.input_date_start=QDateEdit(QDate.currentDate().addMonths(-1))
+        self.input_date_start.setCalendarPopup(True)
+        self.input_date_start.dateChanged.connect(self.cmd_filter)
+        self.input_date_end=QDateEdit(QDate.currentDate())
+        self.input_date_end.setCalendarPopup(True)
+        self.input_date_end.dateChanged.connect(self.cmd_filter)
+        layout_date.addWidget(self.input_date)
+        layout_date.addWidget(self.input_date_start)
+        layout_date.addWidget(QLabel("to"))
+        layout_date.addWidget(self.input_date_end)
+        layout_date.addStretch()
+        layout2.addRow("Filter by Date:", layout_date)
         layout3=QHBoxLayout()
         button_view=QPushButton("View Prescription")
         button_view.clicked.connect(self.cmd_view)
@@ -54,71 +83,151 @@ class Index(QMainWindow):
         button_open.clicked.connect(self.cmd_open)
         button_copy=QPushButton("Create Copy")
         button_copy.clicked.connect(self.cmd_copy)
-        button_rebuild=QPushButton("Rebuild Index")
-        button_rebuild.clicked.connect(self.cmd_rebuild)
+        self.button_rebuild=QPushButton("Rebuild Index")
+        self.button_rebuild.clicked.connect(self.cmd_rebuild)
         button_browse=QPushButton("File Browser")
         button_browse.clicked.connect(self.cmd_browse)
         layout3.addWidget(button_view)
         layout3.addWidget(button_open)
         layout3.addWidget(button_copy)
-        layout3.addWidget(button_rebuild)
+        layout3.addWidget(self.button_rebuild)
         layout3.addWidget(button_browse)
         layout.addLayout(layout2)
         layout.addLayout(layout3)
         layout.addWidget(self.table)
 
         self.unrenderbox=UnrenderBox()
+        self.store=IndexStore()
+        self.model=IndexModel(self.store)
+        self.table.setModel(self.model)
+        self.table.sortByColumn(6, Qt.SortOrder.DescendingOrder)
+        self.table.horizontalHeader().sortIndicatorChanged.connect(self.sort_changed)
+        self.table.selectionModel().currentRowChanged.connect(self.prefetch)
 
         self.worker=Worker()
         self.worker.signal_update.connect(self.update)
         self.worker.start()
 
+        self.rebuilder=Rebuilder()
+        self.rebuilder.signal_batch.connect(self.add_batch)
+        self.rebuilder.signal_remove.connect(self.remove_batch)
+        self.rebuilder.signal_progress.connect(self.show_progress)
+        self.rebuilder.finished.connect(self.rebuild_finished)
+
         self.setCentralWidget(widget)
+        self.statusbar=QStatusBar()
+        self.setStatusBar(self.statusbar)
+        self.progress=QProgressBar()
+        self.progress.setMaximumWidth(200)
+        self.progress.hide()
+        self.statusbar.addPermanentWidget(self.progress)
         self.setWindowIcon(QIcon(os.path.join("resource", "icon_medscript.ico")))
 
-        self.build()
         self.load()
+        self.build()
 
-    def update(self, event_type, src_path):
-        if(src_path.endswith(".mpaz")):
-            if(event_type=="created"):
-                self.add(src_path)
-            elif(event_type=="modified"):
-                self.change(src_path)
-            elif(event_type=="deleted"):
-                self.delete(src_path)
-            self.load()
+    def update(self, events):
+        for event_type, src_path in events:
+            if(src_path.endswith(".mpaz")):
+                if(event_type=="created"):
+                    self.add(src_path, commit=False)
+                elif(event_type=="modified"):
+                    self.change(src_path, commit=False)
+                elif(event_type=="deleted"):
+                    self.delete(src_path, commit=False)
+        self.store.commit()
+        self.signal_change.emit()
 
     def cmd_rebuild(self):
-        self.build()
-        self.load()
+        if(not self.rebuilder.isRunning()):
+            self.store.clear()
+            self.store.commit()
+            self.load()
+            self.build()
 
-    def cmd_filter_pid(self):
-        self.input_id.setText("")
-        self.input_name.setText("")
-        self.proxymodel.setFilterKeyColumn(0)
-        self.proxymodel.setFilterFixedString(self.input_pid.text())
+    def add_batch(self, batch):
+        try:
+            changed=set()
+            for file, row, text, fingerprint in batch:
+                if self.store.row(file) is not None:
+                    changed.add(file)
+                if row is not None:
+                    self.store.put(row, fingerprint, text)
+                else:
+                    self.store.remove(file)
+            self.store.commit()
+            for file, row, text, fingerprint in batch:
+                if file in changed:
+                    self.model.change(file)
+                elif row is not None:
+                    self.model.insert(file, row)
+        except Exception as e:
+            logging.exception(e)
 
-    def cmd_filter_id(self):
-        self.input_pid.setText("")
-        self.input_name.setText("")
-        self.proxymodel.setFilterKeyColumn(1)
-        self.proxymodel.setFilterFixedString(self.input_id.text())
+    def remove_batch(self, files):
+        try:
+            for file in files:
+                self.store.remove(file)
+            self.store.commit()
+            for file in files:
+                self.model.remove(file)
+        except Exception as e:
+            logging.exception(e)
+
+    def show_progress(self, done, total, rate):
+        self.progress.setRange(0, total)
+        self.progress.setValue(done)
+        self.progress.show()
+        self.statusbar.showMessage("Indexed "+str(done)+" of "+str(total)+" files ("+str(round(rate))+" files/s)")
 
-    def cmd_filter_name(self):
-        self.input_pid.setText("")
-        self.input_id.setText("")
-        self.proxymodel.setFilterKeyColumn(2)
-        self.proxymodel.setFilterFixedString(self.input_name.text())
+    def rebuild_finished(self):
+        self.progress.hide()
+        self.table.resizeColumnsToContents()
+        self.signal_change.emit()
+        self.button_rebuild.setEnabled(True)
+
+    def cmd_filter(self):
+        try:
+            conditions=[]
+            params=[]
+            for column, text in [("pid", self.input_pid.text()), ("id", self.input_id.text()), ("name", self.input_name.text())]:
+                if(text):
+                    where, values=self.store.fuzzy(column, text)
+                    conditions.append(where)
+                    params.extend(values)
+            match=None
+            if(self.input_query.text().strip()):
+                where, values=self.store.compile(self.input_query.text())
+                if(where):
+                    conditions.append("("+where+")")
+                    params.extend(values)
+                if(self.input_relevance.isChecked()):
+                    match=self.store.relevance(self.input_query.text())
+            if(self.input_date.isChecked()):
+                start=self.input_date_start.date().toPyDate()
+                end=self.input_date_end.date().toPyDate()+datetime.timedelta(days=1)
+                where, values=self.store.date_range(datetime.datetime.combine(start, datetime.time()), datetime.datetime.combine(end, datetime.time()))
+                conditions.append(where)
+                params.extend(values)
+            self.model.setFilter(" AND ".join(conditions), params, match)
+            self.table.horizontalHeader().setSortIndicatorShown(match is None)
+            self.statusbar.clearMessage()
+        except ValueError as e:
+            self.statusbar.showMessage(str(e))
+        except Exception as e:
+            logging.exception(e)
+
+    def sort_changed(self, column, order):
+        self.table.horizontalHeader().setSortIndicatorShown(True)
+        self.input_relevance.blockSignals(True)
+        self.input_relevance.setChecked(False)
+        self.input_relevance.blockSignals(False)
 
     def cmd_view(self):
         try:
             file=self.getSelectedFile()
             if(file):
-                with ZipFile(file) as zf:
-                    with zf.open("prescription.json") as pf:
-                        prescription=json.loads(pf.read())
-                self.unrenderbox.show(prescription).exec()
+                self.unrenderbox.show(cache.get(file)).exec()
         except Exception as e:
             logging.exception(e)
 
@@ -135,10 +244,7 @@ class Index(QMainWindow):
         try:
             file=self.getSelectedFile()
             if(file):
-                with ZipFile(file) as zf:
-                    with zf.open("prescription.json") as pf:
-                        pres=json.loads(pf.read())
-                self.signal_copy.emit(pres)
+                self.signal_copy.emit(cache.get(file))
                 self.hide()
         except Exception as e:
             logging.exception(e)
@@ -147,10 +253,19 @@ class Index(QMainWindow):
         try:
             file=QFileDialog.getOpenFileName(self, "Browse", config["document_directory"], "Prescriptions (*.mpaz);; PDF (*.pdf);; All Files (*)")[0]
             if(file):
-                with ZipFile(file) as zf:
-                    with zf.open("prescription.json") as pf:
-                        prescription=json.loads(pf.read())
-                self.unrenderbox.show(prescription).exec()
+                self.unrenderbox.show(cache.get(file)).exec()
+        except Exception as e:
+            logging.exception(e)
+
+    def prefetch(self, current, previous):
+        try:
+            files=[]
+            row=current.row()
+            for i in range(self.prefetch_size+1):
+                for j in ([row] if i==0 else [row+i, row-i]):
+                    if(0<=j<self.model.rowCount()):
+                        files.append(self.model.rows.get(j, -1))
+            cache.prefetch(files)
         except Exception as e:
             logging.exception(e)
 
@@ -165,66 +280,290 @@ class Index(QMainWindow):
             logging.exception(e)
 
     def build(self):
+        if(not self.rebuilder.isRunning()):
+            self.button_rebuild.setEnabled(False)
+            self.rebuilder.start()
+
+    def add(self, file, commit=True):
         try:
-            files=glob(os.path.join(config["document_directory"], "**", "*.mpaz"), recursive=True)
-            self.index={}
-            for file in files:
-                self.add(file)
+            fingerprint=IndexStore.fingerprint(file)
+            row, text=IndexStore.extract(file, self.store.fts)
+            self.store.put(row, fingerprint, text)
+            if(commit):
+                self.store.commit()
+            self.model.change(file)
+        except KeyError as e:
+            logging.warning(e)
         except Exception as e:
             logging.exception(e)
 
-    def add(self, file):
+    def delete(self, file, commit=True):
         try:
-            with ZipFile(file) as zf:
-                try:
-                    with zf.open("prescription.json") as pf:
-                        pres=json.loads(pf.read())
-                        self.index[file]=[pres["pid"], pres["id"], pres["name"], pres["dob"], pres["age"], pres["sex"], pres["date"], pres["diagnosis"], file]
-                except KeyError as e:
-                    logging.warning(e)
-                except Exception as e:
-                    logging.exception(e)
+            self.store.remove(file)
+            if(commit):
+                self.store.commit()
+            self.model.remove(file)
         except Exception as e:
             logging.exception(e)
 
-    def delete(self, file):
+    def change(self, file, commit=True):
+        if os.path.exists(file):
+            self.add(file, commit)
+        else:
+            self.delete(file, commit)
+
+    def load(self):
+        self.model.refresh()
+        self.table.resizeColumnsToContents()
+
+class IndexModel(QAbstractTableModel):
+
+    header=["Patient ID", "Prescription ID", "Name", "Date of Birth", "Age", "Sex", "Date", "Diagnosis", "File"]
+    page_size=256
+
+    def __init__(self, store, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store=store
+        self.rows=IndexTable(len(self.header))
+        self.exhausted=False
+        self.window=0
+        self.where=""
+        self.params=[]
+        self.match=None
+        self.column=6
+        self.descending=True
+
+    def key(self, row):
+        return IndexStore.key(row, self.store.columns[self.column])
+
+    def rowKey(self, position):
+        return self.key(self.rows.row(position))
+
+    def refresh(self):
+        self.beginResetModel()
+        self.rows.clear()
+        self.exhausted=False
+        self.window=0
+        self.endResetModel()
+        self.fetchMore()
+
+    def setFilter(self, where="", params=[], match=None):
+        self.where=where
+        self.params=params
+        self.match=match
+        self.refresh()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.match=None
+        self.column=column
+        self.descending=(order==Qt.SortOrder.DescendingOrder)
+        self.refresh()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if(parent.isValid() or self.exhausted):
+            return
+        self.window=len(self.rows)+self.page_size
         try:
-            del self.index[file]
-        except KeyError as e:
-            logging.warning(e)
+            if self.match is not None:
+                rows=self.store.ranked(self.where, self.params, self.match, len(self.rows), self.page_size)
+            else:
+                after=self.rowKey(len(self.rows)-1) if len(self.rows) else None
+                rows=self.store.page(self.where, self.params, self.store.columns[self.column], self.descending, after, self.page_size)
         except Exception as e:
             logging.exception(e)
+            rows=[]
+        if(len(rows)<self.page_size):
+            self.exhausted=True
+        if(rows):
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows)+len(rows)-1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def position(self, key):
+        low=0
+        high=len(self.rows)
+        while(low<high):
+            middle=(low+high)//2
+            if((self.rowKey(middle)>key) if self.descending else (self.rowKey(middle)<key)):
+                low=middle+1
+            else:
+                high=middle
+        return low
+
+    def insert(self, file, row=None):
+        if self.match is not None:
+            return
+        if(row is None or self.where):
+            row=self.store.row(file, self.where, self.params)
+        if row is None:
+            return
+        position=self.position(self.key(row))
+        if(position>=self.window):
+            self.exhausted=False
+            return
+        if(position<len(self.rows) or self.exhausted):
+            self.beginInsertRows(QModelIndex(), position, position)
+            self.rows.insert(position, row)
+            self.endInsertRows()
+            if(len(self.rows)>self.window):
+                self.exhausted=False
+                self.beginRemoveRows(QModelIndex(), len(self.rows)-1, len(self.rows)-1)
+                self.rows.delete(len(self.rows)-1)
+                self.endRemoveRows()
 
     def change(self, file):
-        self.delete(file)
-        self.add(file)
+        if self.match is not None:
+            position=self.rows.find(file)
+            if(position>=0):
+                row=self.store.row(file, self.where, self.params)
+                self.beginRemoveRows(QModelIndex(), position, position)
+                self.rows.delete(position)
+                self.endRemoveRows()
+                if row is not None:
+                    self.beginInsertRows(QModelIndex(), position, position)
+                    self.rows.insert(position, row)
+                    self.endInsertRows()
+            return
+        self.remove(file)
+        self.insert(file)
 
-    def load(self):
-        model=QStandardItemModel()
-        model.setHorizontalHeaderLabels(["Patient ID", "Prescription ID", "Name", "Date of Birth", "Age", "Sex", "Date", "Diagnosis", "File"])
-        for key, item in self.index.items():
-            row=[]
-            for i in item:
-                row.append(QStandardItem(i))
-            model.appendRow(row)
-        self.proxymodel.setSourceModel(model)
-        self.proxymodel.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-        self.table.setModel(self.proxymodel)
-        self.table.resizeColumnsToContents()
+    def remove(self, file):
+        row=self.rows.find(file)
+        if(row>=0):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.rows.delete(row)
+            self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if(parent.isValid()):
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if(parent.isValid()):
+            return 0
+        return len(self.header)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if(index.isValid() and role==Qt.ItemDataRole.DisplayRole):
+            return self.rows.get(index.row(), index.column())
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if(orientation==Qt.Orientation.Horizontal and role==Qt.ItemDataRole.DisplayRole):
+            return self.header[section]
 
 class WatchHandler(FileSystemEventHandler):
-    def __init__(self, signal):
+    def __init__(self, queue):
         super().__init__()
-        self.signal=signal
+        self.queue=queue
     def on_any_event(self, event):
         if not event.is_directory:
-            self.signal.emit(event.event_type, event.src_path)
+            if(event.event_type=="moved"):
+                self.queue("deleted", event.src_path)
+                self.queue("created", event.dest_path)
+            else:
+                self.queue(event.event_type, event.src_path)
+
+class Rebuilder(QThread):
+
+    signal_batch=pyqtSignal(list)
+    signal_remove=pyqtSignal(list)
+    signal_progress=pyqtSignal(int, int, float)
+
+    batch_size=500
+    batch_interval=0.5
+    first_batch=64
+    pool_threshold=256
+
+    def run(self):
+        try:
+            store=IndexStore()
+            stored=store.files()
+            fts=store.fts
+            files=[]
+            for file in glob(os.path.join(config["document_directory"], "**", "*.mpaz"), recursive=True):
+                try:
+                    fingerprint=IndexStore.fingerprint(file)
+                    if(stored.pop(file, None)!=fingerprint):
+                        files.append((fingerprint[1], file))
+                except OSError as e:
+                    logging.warning(e)
+            if(stored):
+                self.signal_remove.emit(list(stored))
+            files=[file for mtime, file in sorted(files, reverse=True)]
+            total=len(files)
+            start=time.monotonic()
+            batch=[IndexStore.scan(file, fts) for file in files[:self.first_batch]]
+            done=len(batch)
+            if(batch):
+                self.signal_batch.emit(batch)
+                self.signal_progress.emit(done, total, done/max(time.monotonic()-start, 0.001))
+            batch=[]
+            last=time.monotonic()
+            if(total-done>self.pool_threshold):
+                jobs=os.cpu_count() or 1
+                executor=ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn"))
+                results=executor.map(IndexStore.scan, files[done:], [fts]*(total-done), chunksize=max(1, min(64, (total-done)//(jobs*4))))
+            else:
+                executor=None
+                results=map(IndexStore.scan, files[done:], [fts]*(total-done))
+            try:
+                for result in results:
+                    batch.append(result)
+                    done=done+1
+                    now=time.monotonic()
+                    if(len(batch)>=self.batch_size or now-last>=self.batch_interval or done==total):
+                        self.signal_batch.emit(batch)
+                        self.signal_progress.emit(done, total, done/max(now-start, 0.001))
+                        batch=[]
+                        last=now
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        except Exception as e:
+            logging.exception(e)
 
 class Worker(QThread):
-    signal_update=pyqtSignal(str, str)
+
+    signal_update=pyqtSignal(list)
+
+    interval=0.5
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock=threading.Lock()
+        self.pending={}
+
+    def queue(self, event_type, path):
+        if(event_type not in ["created", "modified", "deleted"] or not path.endswith(".mpaz")):
+            return
+        with self.lock:
+            previous=self.pending.pop(path, [None])[0]
+            if(event_type=="deleted"):
+                if(previous=="created"):
+                    return
+            elif(previous=="deleted"):
+                event_type="modified"
+            elif(previous=="created"):
+                event_type="created"
+            self.pending[path]=[event_type, time.monotonic()]
+
     def run(self):
-        self.watchHandler=WatchHandler(self.signal_update)
+        self.watchHandler=WatchHandler(self.queue)
         self.observer=Observer()
         self.observer.schedule(self.watchHandler, path=config["document_directory"], recursive=True)
         self.observer.start()
-        self.observer.join()
+        while self.observer.is_alive():
+            self.observer.join(self.interval/2)
+            events=[]
+            with self.lock:
+                now=time.monotonic()
+                for path, (event_type, last) in list(self.pending.items()):
+                    if(now-last>=self.interval):
+                        events.append((event_type, path))
+                        del self.pending[path]
+            if(events):
+                self.signal_update.emit(events)
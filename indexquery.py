@@ -0,0 +1,183 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import re, datetime, dateutil.parser
+
+class IndexQuery():
+
+    pattern=re.compile(r'\s*(-)?(?:([A-Za-z]+)(:|>=|<=|=|>|<|~))?("(?:[^"]|"")*"|[^\s"]+)')
+    exact=["pid", "id"]
+    like=["name", "file"]
+    fuzzy=["name"]
+    prefix=["sex"]
+    fulltext=["diagnosis", "text"]
+    dates={"date": "date_value", "dob": "dob_value"}
+    numbers={"age": "age_value"}
+    threshold=0.3
+
+    def __init__(self, text, fts=True, spellings=None):
+        self.text=text
+        self.fts=fts
+        self.spellings=spellings
+        self.conditions=[]
+        self.params=[]
+        self.match=[]
+        self.exclude=[]
+
+    def compile(self):
+        position=0
+        text=self.text.strip()
+        while(position<len(text)):
+            token=self.pattern.match(text, position)
+            if token is None:
+                raise ValueError("Invalid query near: "+text[position:])
+            position=token.end()
+            negate, field, operator, value=token.groups()
+            if(value.startswith("\"")):
+                value=value[1:-1].replace("\"\"", "\"")
+            self.term(field.lower() if field else None, operator, value, bool(negate))
+        if(self.match):
+            if(not self.fts):
+                raise ValueError("Full text search is not available")
+            self.conditions.append("rowid IN (SELECT rowid FROM content WHERE content MATCH ?)")
+            self.params.append(" ".join(self.match))
+        for i in self.exclude:
+            if(not self.fts):
+                raise ValueError("Full text search is not available")
+            self.conditions.append("rowid NOT IN (SELECT rowid FROM content WHERE content MATCH ?)")
+            self.params.append(i)
+        return (" AND ".join(self.conditions), self.params)
+
+    def add(self, condition, params, negate):
+        if(negate):
+            condition="NOT ("+condition+")"
+        self.conditions.append(condition)
+        self.params.extend(params)
+
+    def phrase(self, value, column=None):
+        words=value.split()
+        if(len(words)>1):
+            phrase="\""+value.replace("\"", "\"\"")+"\""
+        else:
+            phrase="\""+value.replace("\"", "\"\"")+"\"*"
+        if column is not None:
+            phrase=column+" : "+phrase
+        return phrase
+
+    def term(self, field, operator, value, negate):
+        if field is None or field=="text":
+            phrase=self.phrase(value)
+        elif(field=="diagnosis"):
+            phrase=self.phrase(value, "diagnosis")
+        else:
+            phrase=None
+        if phrase is not None:
+            if(operator not in [None, ":", "="]):
+                raise ValueError("Operator "+operator+" is not supported for "+(field or "text"))
+            if(negate):
+                self.exclude.append(phrase)
+            else:
+                self.match.append(phrase)
+        elif(field in self.exact):
+            if(operator not in [":", "="]):
+                raise ValueError("Operator "+operator+" is not supported for "+field)
+            if(value.endswith("*")):
+                value=value.rstrip("*")
+                if(value):
+                    self.add(field+">=? AND "+field+"<?", [value, value[:-1]+chr(ord(value[-1])+1)], negate)
+            else:
+                self.add(field+"=?", [value], negate)
+        elif(field in self.fuzzy and operator=="~"):
+            self.add(*self.similar(field, value), negate)
+        elif(field in self.like):
+            if(operator not in [":", "="]):
+                raise ValueError("Operator "+operator+" is not supported for "+field)
+            self.add(field+" LIKE ? ESCAPE '\\'", ["%"+self.escape(value)+"%"], negate)
+        elif(field in self.prefix):
+            if(operator not in [":", "="]):
+                raise ValueError("Operator "+operator+" is not supported for "+field)
+            self.add(field+" LIKE ? ESCAPE '\\'", [self.escape(value)+"%"], negate)
+        elif(field in self.dates):
+            start, end=self.period(value)
+            self.compare(self.dates[field], operator, start, end, negate)
+        elif(field in self.numbers):
+            try:
+                number=float(value)
+            except ValueError:
+                raise ValueError("Invalid number: "+value)
+            self.compare(self.numbers[field], operator, number, number+1 if number.is_integer() else number, negate)
+        else:
+            raise ValueError("Unknown field: "+field)
+
+    def compare(self, column, operator, start, end, negate):
+        if(operator in [":", "="]):
+            if(start==end):
+                self.add(column+"=?", [start], negate)
+            else:
+                self.add(column+">=? AND "+column+"<?", [start, end], negate)
+        elif(operator==">="):
+            self.add(column+">=?", [start], negate)
+        elif(operator==">"):
+            self.add(column+">=?" if start!=end else column+">?", [end], negate)
+        elif(operator=="<="):
+            self.add(column+"<?" if start!=end else column+"<=?", [end], negate)
+        elif(operator=="<"):
+            self.add(column+"<?", [start], negate)
+
+    def words(text):
+        return re.findall(r"\w+", text.lower())
+
+    def grams(word):
+        word="  "+word+" "
+        return {word[i:i+3] for i in range(len(word)-2)}
+
+    def similar(self, field, value, prefix=False):
+        words=IndexQuery.words(value)
+        if(not words):
+            raise ValueError("Invalid "+field+": "+value)
+        if self.spellings is None:
+            raise ValueError("Approximate search is not available")
+        conditions=[]
+        params=[]
+        for word in words:
+            spellings=self.spellings(word)
+            matches=[]
+            if(spellings):
+                matches.append("word IN ("+", ".join(["?"]*len(spellings))+")")
+                params.extend(spellings)
+            if(prefix):
+                matches.append("(word>=? AND word<?)")
+                params.extend([word, word[:-1]+chr(ord(word[-1])+1)])
+            if(not matches):
+                return ("0", [])
+            conditions.append("SELECT name FROM name_word WHERE "+" OR ".join(matches))
+        return (field+" IN ("+" INTERSECT ".join(conditions)+")", params)
+
+    def escape(self, value):
+        return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    def period(self, value):
+        epoch=datetime.datetime(1970, 1, 1)
+        match=re.fullmatch(r"(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?", value)
+        try:
+            if match:
+                year, month, day=match.groups()
+                if day is not None:
+                    start=datetime.datetime(int(year), int(month), int(day))
+                    end=start+datetime.timedelta(days=1)
+                elif month is not None:
+                    start=datetime.datetime(int(year), int(month), 1)
+                    end=datetime.datetime(int(year)+int(month)//12, int(month)%12+1, 1)
+                else:
+                    start=datetime.datetime(int(year), 1, 1)
+                    end=datetime.datetime(int(year)+1, 1, 1)
+            else:
+                start=dateutil.parser.parse(value).replace(tzinfo=None)
+                end=start+datetime.timedelta(days=1)
+        except (ValueError, OverflowError):
+            raise ValueError("Invalid date: "+value)
+        return ((start-epoch).total_seconds(), (end-epoch).total_seconds())
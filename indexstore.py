@@ -0,0 +1,257 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, json, sqlite3, re, zlib, datetime, dateutil.parser
+from zipfile import ZipFile
+from config import config
+from indexquery import IndexQuery
+
+class IndexStore():
+
+    version=6
+    columns=["pid", "id", "name", "dob", "age", "sex", "date", "diagnosis", "file"]
+    typed={"dob": "dob_value", "age": "age_value", "date": "date_value"}
+    text_columns=["pid", "id", "name", "diagnosis", "note", "report", "advice", "investigation", "medication", "additional", "certificate"]
+    fts=True
+
+    def __init__(self, file=None):
+        if file is None:
+            file=config["index_file"]
+        self.connection=sqlite3.connect(file)
+        if(self.connection.execute("PRAGMA user_version").fetchone()[0]!=self.version):
+            self.connection.execute("DROP TABLE IF EXISTS prescription")
+            self.connection.execute("DROP TABLE IF EXISTS content")
+            self.connection.execute("DROP TABLE IF EXISTS name_word")
+            self.connection.execute("DROP TABLE IF EXISTS word_gram")
+            self.connection.execute("PRAGMA user_version="+str(self.version))
+        self.connection.execute("CREATE TABLE IF NOT EXISTS prescription (file TEXT PRIMARY KEY, pid TEXT, id TEXT, name TEXT, dob TEXT, age TEXT, sex TEXT, date TEXT, diagnosis TEXT, dob_value REAL, age_value REAL, date_value REAL, size INTEGER, mtime INTEGER)")
+        for column in self.columns[:-1]:
+            column=self.typed.get(column, column)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS prescription_"+column+" ON prescription ("+column+", file)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS prescription_history ON prescription (pid, date_value, file)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS name_word (word TEXT, name TEXT, PRIMARY KEY (word, name)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS name_word_name ON name_word (name)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS word_gram (gram TEXT, word TEXT, size INTEGER, PRIMARY KEY (gram, word)) WITHOUT ROWID")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS word_gram_word ON word_gram (word)")
+        try:
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS content USING fts5("+", ".join(self.text_columns)+")")
+        except sqlite3.OperationalError as e:
+            self.fts=False
+            logging.warning(e)
+        self.connection.commit()
+
+    def fingerprint(file):
+        stat=os.stat(file)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def summary(file):
+        with open(file, "rb") as f:
+            data=f.read()
+        pres=json.loads(data)
+        fields={i: pres.get(i) for i in IndexStore.columns[:-1]}
+        summary=json.dumps({"type": "MedScript", "summary": 2, "crc": zlib.crc32(data), "fields": fields}, separators=(",", ":")).encode()
+        if(len(summary)>65535):
+            return b""
+        return summary
+
+    def read_summary(zf):
+        if(zf.comment):
+            try:
+                summary=json.loads(zf.comment)
+                if(summary["type"]=="MedScript" and summary["summary"] in (1, 2) and summary["crc"]==zf.getinfo("prescription.json").CRC):
+                    return summary["fields"]
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(e)
+
+    def extract(file, text=True):
+        with ZipFile(file) as zf:
+            pres=None if text else IndexStore.read_summary(zf)
+            if pres is None:
+                with zf.open("prescription.json") as pf:
+                    pres=json.loads(pf.read())
+        row=[pres["pid"], pres["id"], pres["name"], pres["dob"], pres["age"], pres["sex"], pres["date"], pres["diagnosis"], file]
+        row=["" if i is None else str(i) for i in row]
+        if(text):
+            text=[pres.get(i) or "" for i in IndexStore.text_columns]
+        else:
+            text=None
+        return (row, text)
+
+    def parse_date(text):
+        try:
+            try:
+                date=datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                date=dateutil.parser.parse(text)
+            return (date.replace(tzinfo=None)-datetime.datetime(1970, 1, 1)).total_seconds()
+        except Exception:
+            return float("-inf")
+
+    def parse_age(age, dob="", date=""):
+        match=re.match(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)", age)
+        if match:
+            unit=match.group(2).lower()
+            if(unit.startswith("d")):
+                return float(match.group(1))/365.25
+            elif(unit.startswith("w")):
+                return float(match.group(1))/52.18
+            elif(unit.startswith("m")):
+                return float(match.group(1))/12
+            return float(match.group(1))
+        birth=IndexStore.parse_date(dob)
+        visit=IndexStore.parse_date(date)
+        if(birth>float("-inf") and visit>float("-inf")):
+            return (visit-birth)/(365.25*86400)
+        return float("-inf")
+
+    def values(row):
+        return [IndexStore.parse_date(row[3]), IndexStore.parse_age(row[4], row[3], row[6]), IndexStore.parse_date(row[6])]
+
+    def key(row, column):
+        if(column=="dob"):
+            return (IndexStore.parse_date(row[3]), row[-1])
+        elif(column=="age"):
+            return (IndexStore.parse_age(row[4], row[3], row[6]), row[-1])
+        elif(column=="date"):
+            return (IndexStore.parse_date(row[6]), row[-1])
+        return (row[IndexStore.columns.index(column)], row[-1])
+
+    def scan(file, text=True):
+        try:
+            fingerprint=IndexStore.fingerprint(file)
+            row, text=IndexStore.extract(file, text)
+            return (file, row, text, fingerprint)
+        except KeyError as e:
+            logging.warning(e)
+        except Exception as e:
+            logging.exception(e)
+        return (file, None, None, None)
+
+    def files(self):
+        return {row[0]: (row[1], row[2]) for row in self.connection.execute("SELECT file, size, mtime FROM prescription")}
+
+    def put(self, row, fingerprint, text):
+        self.remove(row[-1])
+        rowid=self.connection.execute("INSERT INTO prescription ("+", ".join(self.columns)+", dob_value, age_value, date_value, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", list(row)+IndexStore.values(row)+list(fingerprint)).lastrowid
+        if(self.fts):
+            self.connection.execute("INSERT INTO content (rowid, "+", ".join(self.text_columns)+") VALUES (?"+", ?"*len(self.text_columns)+")", [rowid]+list(text))
+        self.add_name(row[2])
+
+    def remove(self, file):
+        for rowid, name in self.connection.execute("SELECT rowid, name FROM prescription WHERE file=?", [file]).fetchall():
+            if(self.fts):
+                self.connection.execute("DELETE FROM content WHERE rowid=?", [rowid])
+            self.connection.execute("DELETE FROM prescription WHERE rowid=?", [rowid])
+            self.remove_name(name)
+
+    def add_name(self, name):
+        if(name and self.connection.execute("SELECT 1 FROM name_word WHERE name=? LIMIT 1", [name]).fetchone() is None):
+            for word in set(IndexQuery.words(name)):
+                if(self.connection.execute("SELECT 1 FROM word_gram WHERE word=? LIMIT 1", [word]).fetchone() is None):
+                    grams=IndexQuery.grams(word)
+                    self.connection.executemany("INSERT INTO word_gram (gram, word, size) VALUES (?, ?, ?)", [(gram, word, len(grams)) for gram in grams])
+                self.connection.execute("INSERT INTO name_word (word, name) VALUES (?, ?)", [word, name])
+
+    def remove_name(self, name):
+        if(self.connection.execute("SELECT 1 FROM prescription WHERE name=? LIMIT 1", [name]).fetchone() is None):
+            for word, in self.connection.execute("SELECT word FROM name_word WHERE name=?", [name]).fetchall():
+                self.connection.execute("DELETE FROM name_word WHERE word=? AND name=?", [word, name])
+                if(self.connection.execute("SELECT 1 FROM name_word WHERE word=? LIMIT 1", [word]).fetchone() is None):
+                    self.connection.execute("DELETE FROM word_gram WHERE word=?", [word])
+
+    def clear(self):
+        self.connection.execute("DELETE FROM prescription")
+        self.connection.execute("DELETE FROM name_word")
+        self.connection.execute("DELETE FROM word_gram")
+        if(self.fts):
+            self.connection.execute("DELETE FROM content")
+
+    def like(self, column, text):
+        if(column not in self.columns):
+            raise ValueError("Unknown column "+column)
+        return (column+" LIKE ? ESCAPE '\\'", ["%"+text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")+"%"])
+
+    def spellings(self, word):
+        grams=IndexQuery.grams(word)
+        return [row[0] for row in self.connection.execute("SELECT word, COUNT(*)*1.0/(?+MAX(size)-COUNT(*)) AS score FROM word_gram WHERE gram IN ("+", ".join(["?"]*len(grams))+") GROUP BY word HAVING score>=? ORDER BY score DESC", [len(grams)]+list(grams)+[IndexQuery.threshold])]
+
+    def fuzzy(self, column, text):
+        words=IndexQuery.words(text)
+        if(column in IndexQuery.fuzzy and words and min(len(word) for word in words)>=3):
+            similar, similar_params=IndexQuery(text, self.fts, self.spellings).similar(column, text, True)
+            like, like_params=self.like(column, text)
+            return ("("+similar+" OR "+like+")", list(similar_params)+like_params)
+        return self.like(column, text)
+
+    def compile(self, text):
+        return IndexQuery(text, self.fts, self.spellings).compile()
+
+    def page(self, where="", params=[], column="date", descending=False, after=None, limit=256):
+        if(column not in self.columns):
+            raise ValueError("Unknown column "+column)
+        conditions=[]
+        values=[]
+        if(where):
+            conditions.append("("+where+")")
+            values.extend(params)
+        order=self.typed.get(column, column)
+        if after is not None:
+            conditions.append("("+order+", file) "+("<" if descending else ">")+" (?, ?)")
+            values.extend(after)
+        sql="SELECT "+", ".join(self.columns)+" FROM prescription"
+        if(conditions):
+            sql=sql+" WHERE "+" AND ".join(conditions)
+        direction=" DESC" if descending else ""
+        sql=sql+" ORDER BY "+order+direction+", file"+direction+" LIMIT ?"
+        values.append(limit)
+        return self.connection.execute(sql, values).fetchall()
+
+    def relevance(self, text):
+        query=IndexQuery(text, self.fts, self.spellings)
+        query.compile()
+        if(query.match):
+            return " ".join(query.match)
+        return None
+
+    def ranked(self, where="", params=[], match="", offset=0, limit=256):
+        sql="SELECT "+", ".join("prescription."+i for i in self.columns)+" FROM content JOIN prescription ON prescription.rowid=content.rowid WHERE content MATCH ?"
+        values=[match]
+        if(where):
+            sql=sql+" AND prescription.rowid IN (SELECT rowid FROM prescription WHERE "+where+")"
+            values.extend(params)
+        sql=sql+" ORDER BY rank, prescription.file LIMIT ? OFFSET ?"
+        values.extend([limit, offset])
+        return self.connection.execute(sql, values).fetchall()
+
+    def date_range(self, start=None, end=None):
+        conditions=[]
+        params=[]
+        if start is not None:
+            conditions.append("date_value>=?")
+            params.append((start-datetime.datetime(1970, 1, 1)).total_seconds())
+        if end is not None:
+            conditions.append("date_value<?")
+            params.append((end-datetime.datetime(1970, 1, 1)).total_seconds())
+        return (" AND ".join(conditions), params)
+
+    def between(self, start=None, end=None):
+        where, params=self.date_range(start, end)
+        return self.page(where, params, "date", limit=-1)
+
+    def history(self, pid, limit=-1):
+        if(not pid):
+            return []
+        return self.connection.execute("SELECT "+", ".join(self.columns)+" FROM prescription WHERE pid=? ORDER BY date_value DESC, file DESC LIMIT ?", [pid, limit]).fetchall()
+
+    def row(self, file, where="", params=[]):
+        sql="SELECT "+", ".join(self.columns)+" FROM prescription WHERE file=?"
+        if(where):
+            sql=sql+" AND ("+where+")"
+        return self.connection.execute(sql, [file]+list(params)).fetchone()
+
+    def commit(self):
+        self.connection.commit()
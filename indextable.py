@@ -0,0 +1,87 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from array import array
+
+class IndexTable():
+
+    __slots__=("width", "encoded", "packed", "text", "offsets", "codes", "values", "lookup")
+
+    def __init__(self, width=9, encoded=(4, 5)):
+        self.width=width
+        self.encoded=encoded
+        self.packed=[i for i in range(width) if i not in encoded]
+        self.text=[]
+        self.offsets=array("I")
+        self.codes={i: array("I") for i in encoded}
+        self.values=[]
+        self.lookup={}
+
+    def __len__(self):
+        return len(self.text)
+
+    def code(self, value):
+        try:
+            return self.lookup[value]
+        except KeyError:
+            self.values.append(sys.intern(value))
+            self.lookup[value]=len(self.values)-1
+            return self.lookup[value]
+
+    def pack(self, row):
+        text=""
+        offsets=array("I")
+        for i in self.packed:
+            text=text+row[i]
+            offsets.append(len(text))
+        return (text, offsets)
+
+    def insert(self, position, row):
+        text, offsets=self.pack(row)
+        self.text.insert(position, text)
+        n=len(self.packed)
+        self.offsets[position*n:position*n]=offsets
+        for i in self.encoded:
+            self.codes[i].insert(position, self.code(row[i]))
+
+    def append(self, row):
+        self.insert(len(self.text), row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def delete(self, position):
+        del self.text[position]
+        n=len(self.packed)
+        del self.offsets[position*n:(position+1)*n]
+        for i in self.encoded:
+            del self.codes[i][position]
+
+    def clear(self):
+        self.text=[]
+        self.offsets=array("I")
+        self.codes={i: array("I") for i in self.encoded}
+
+    def get(self, position, column):
+        column=column%self.width
+        if column in self.codes:
+            return self.values[self.codes[column][position]]
+        n=len(self.packed)
+        field=self.packed.index(column)
+        start=self.offsets[position*n+field-1] if field>0 else 0
+        return self.text[position][start:self.offsets[position*n+field]]
+
+    def row(self, position):
+        return tuple(self.get(position, i) for i in range(self.width))
+
+    def find(self, value, column=-1):
+        for i in range(len(self.text)):
+            if(self.get(i, column)==value):
+                return i
+        return -1
@@ -10,7 +10,8 @@ from PyQt6.QtGui import QIcon, QStandardItemModel, QStandardItem
 from glob import glob
 from zipfile import ZipFile
 from config import config
-import logging, os, tempfile, shutil
+from scratch import scratch
+import logging, os, shutil
 
 class Installer(QMainWindow):
 
@@ -25,7 +26,7 @@ class Installer(QMainWindow):
     def cmd_install(self):
         try:
             file=QFileDialog.getOpenFileName(self, "Open Package", config["data_directory"], "Zip (*.zip);; All Files (*)")[0]
-            self.directory=tempfile.TemporaryDirectory()
+            self.directory=scratch.get()
             with ZipFile(file, "r", strict_timestamps=False) as package:
                 package.extractall(self.directory.name)
             for i in glob(os.path.join(self.directory.name, "preset", "*.csv")):
@@ -5,18 +5,25 @@
 # MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
 
-import logging, sys, os
+import logging, sys, os, multiprocessing
 from logging.handlers import RotatingFileHandler
-from PyQt6.QtWidgets import QApplication
-from window import MainWindow
 from config import config
 
 if __name__=="__main__":
+    multiprocessing.freeze_support()
     logging.basicConfig(level=logging.INFO,
             format="[%(asctime)s] (%(module)s / %(funcName)s) %(levelname)s : %(message)s",
             handlers=[RotatingFileHandler(os.path.join(config["log_directory"], "log.txt"), maxBytes=100000, backupCount=9), logging.StreamHandler()],
             force=True
             )
+    if(config["command"]=="repack"):
+        from repack import main
+        sys.exit(main())
+    elif(config["command"]=="render"):
+        from batchrender import main
+        sys.exit(main())
+    from PyQt6.QtWidgets import QApplication
+    from window import MainWindow
     app=QApplication(sys.argv)
     with open(os.path.join(config["resource"], "style.qss")) as qss:
         app.setStyleSheet(qss.read())
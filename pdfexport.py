@@ -0,0 +1,123 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtWebEngineCore import QWebEnginePage, QWebEngineProfile
+from PyQt6.QtGui import QPageLayout, QPageSize
+from PyQt6.QtCore import QObject, QEvent, QUrl, QMarginsF, QTimer, pyqtSignal
+from collections import deque
+import logging, os, sys, time
+
+class PdfExporter(QObject):
+
+    signal_exported=pyqtSignal(str, str, bool, float)
+    signal_finished=pyqtSignal()
+
+    def __init__(self, size=4, page="A4", recycle=100, timeout=60000, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recycle=recycle
+        self.timeout=timeout
+        self.layout=QPageLayout(QPageSize(QPageSize.PageSizeId[page]), QPageLayout.Orientation.Portrait, QMarginsF())
+        self.profile=QWebEngineProfile(self)
+        self.queue=deque()
+        self.jobs={}
+        self.count={}
+        self.idle=[]
+        self.warming=set()
+        for i in range(max(1, size)):
+            self.create()
+
+    def create(self):
+        page=QWebEnginePage(self.profile, self)
+        page.loadFinished.connect(lambda ok, page=page: self.loaded(page, ok))
+        page.pdfPrintingFinished.connect(lambda file, ok, page=page: self.done(page, ok))
+        self.count[page]=0
+        self.warming.add(page)
+        page.setUrl(QUrl("about:blank"))
+
+    def add(self, source, target):
+        self.queue.append((source, target))
+        self.dispatch()
+
+    def dispatch(self):
+        while(self.idle and self.queue):
+            page=self.idle.pop()
+            job=self.queue.popleft()+(time.perf_counter(),)
+            self.jobs[page]=job
+            QTimer.singleShot(self.timeout, lambda page=page, job=job: self.expire(page, job))
+            page.load(QUrl.fromLocalFile(job[0]))
+        if(not self.queue and not self.jobs and not self.warming):
+            self.signal_finished.emit()
+
+    def loaded(self, page, ok):
+        if page in self.warming:
+            self.warming.discard(page)
+            self.idle.append(page)
+            self.dispatch()
+            return
+        if page not in self.jobs:
+            return
+        if(ok):
+            page.printToPdf(self.jobs[page][1], self.layout)
+        else:
+            self.done(page, False)
+
+    def expire(self, page, job):
+        if(self.jobs.get(page) is job):
+            logging.warning("Timed out exporting "+job[0])
+            self.done(page, False, True)
+
+    def done(self, page, ok, recycle=False):
+        if page not in self.jobs:
+            return
+        source, target, start=self.jobs.pop(page)
+        self.count[page]=self.count[page]+1
+        if(recycle or self.count[page]>=self.recycle):
+            page.loadFinished.disconnect()
+            page.pdfPrintingFinished.disconnect()
+            del self.count[page]
+            page.deleteLater()
+            self.create()
+        else:
+            self.idle.append(page)
+        self.signal_exported.emit(source, target, ok, time.perf_counter()-start)
+        self.dispatch()
+
+    def close(self):
+        for page in self.count:
+            page.deleteLater()
+        self.queue.clear()
+        self.jobs={}
+        self.count={}
+        self.idle=[]
+        self.warming=set()
+        QApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+        self.profile.deleteLater()
+        QApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+
+def export(files, size=4, page="A4", report=None):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app=QApplication.instance()
+    if app is None:
+        app=QApplication(sys.argv)
+    exporter=PdfExporter(size, page)
+    failed=[]
+    def exported(source, target, ok, elapsed):
+        if(not ok):
+            failed.append(source)
+        if report is not None:
+            report(source, target, ok, elapsed)
+    exporter.signal_exported.connect(exported)
+    exporter.signal_finished.connect(app.quit)
+    try:
+        for source, target in files:
+            exporter.add(source, target)
+        if(files):
+            app.exec()
+    finally:
+        exporter.close()
+    return failed
@@ -5,14 +5,18 @@
 # MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
 # You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
 
-import logging, os, shutil, tempfile, json, datetime, re
+import logging, os, shutil, tempfile, json, datetime, re, hashlib
+from collections import OrderedDict
 from markdown import markdown
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from config import config
 
 class Renderer:
 
     tempdir=None
+    templates=OrderedDict()
+    cache_size=32
+    bytecode_cache=None
 
     def render(self, data_directory):
         try:
@@ -23,7 +27,7 @@ class Renderer:
                 shutil.copytree(config["template"], os.path.join(data_directory, "template"), dirs_exist_ok=True)
             with open(source, "r") as source_file, open(target, "w") as target_file:
                 with open(template) as template_file:
-                    template_data = Template(template_file.read())
+                    template_data = self.load_template(template, template_file.read())
                     data=self.process_medication(self.process_diagnosis(json.loads(source_file.read())))
                     if config["markdown"]:
                         data=self.render_markdown(data)
@@ -37,6 +41,26 @@ class Renderer:
         except Exception as e:
             logging.exception(e)
 
+    def load_template(self, file, source):
+        if Renderer.bytecode_cache is None:
+            Renderer.bytecode_cache=FileSystemBytecodeCache(config["cache_directory"])
+        directory=os.path.dirname(os.path.abspath(file))
+        name=os.path.basename(file)
+        key=(directory, hashlib.sha256(source.encode()).hexdigest())
+        if key in Renderer.templates:
+            Renderer.templates.move_to_end(key)
+            return Renderer.templates[key]
+        environment=Environment(loader=FileSystemLoader(directory), bytecode_cache=Renderer.bytecode_cache, cache_size=0)
+        bucket=environment.bytecode_cache.get_bucket(environment, name, key[1], source)
+        if bucket.code is None:
+            bucket.code=environment.compile(source, name, file)
+            environment.bytecode_cache.set_bucket(bucket)
+        template=environment.template_class.from_code(environment, bucket.code, environment.make_globals(None))
+        Renderer.templates[key]=template
+        while(len(Renderer.templates)>Renderer.cache_size):
+            Renderer.templates.popitem(last=False)
+        return template
+
     def process_diagnosis(self, data):
         diagnosis_list=[]
         for d in data["diagnosis"].split(";"):
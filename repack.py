@@ -0,0 +1,137 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, glob, json, shutil, time, zlib
+from zipfile import ZipFile
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import config
+from filehandler import FileHandler
+from blobstore import BlobStore
+from scratch import scratch, initialize
+
+skip=["meta.json", "reference.json", "template/output.html"]
+
+def checksum(file):
+    crc=0
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1<<20), b""):
+            crc=zlib.crc32(block, crc)
+    return crc
+
+def verify(original, result):
+    with ZipFile(original) as source, ZipFile(result) as target:
+        if target.testzip() is not None:
+            raise ValueError("CRC check failed for "+target.testzip())
+        meta=json.loads(target.read("meta.json"))
+        if(meta.get("type")!="MedScript" or meta.get("version")!=FileHandler.meta["version"]):
+            raise ValueError("Invalid meta.json")
+        members=target.namelist()
+        references={}
+        if("reference.json" in members):
+            references=json.loads(target.read("reference.json"))
+        for info in source.infolist():
+            if(info.is_dir() or info.filename in skip):
+                continue
+            if(info.filename in references):
+                crc=checksum(BlobStore().get(references[info.filename]))
+            elif(info.filename in members):
+                crc=target.getinfo(info.filename).CRC
+            else:
+                raise ValueError("Missing member "+info.filename)
+            if(crc!=info.CRC):
+                raise ValueError("Content changed for "+info.filename)
+        if("reference.json" in source.namelist()):
+            for name in json.loads(source.read("reference.json")):
+                if(name not in references and name not in members):
+                    raise ValueError("Missing member "+name)
+
+def repack(file):
+    temp=file+".repack"
+    try:
+        stat=os.stat(file)
+        handler=FileHandler(file)
+        handler.open()
+        handler.extract()
+        handler.save(temp, change_template=False)
+        verify(file, temp)
+        shutil.copymode(file, temp)
+        os.utime(temp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        size=os.path.getsize(temp)
+        os.replace(temp, file)
+        return (file, stat.st_size, size, None)
+    except Exception as e:
+        if(os.path.exists(temp)):
+            os.remove(temp)
+        return (file, 0, 0, str(e))
+
+def scanned():
+    return [config["document_directory"]]+config["scan"]
+
+def inside(path, directories):
+    path=os.path.normcase(os.path.abspath(path))
+    for directory in directories:
+        directory=os.path.normcase(os.path.abspath(directory))
+        if(path==directory or path.startswith(directory.rstrip(os.sep)+os.sep)):
+            return True
+    return False
+
+def referenced(files):
+    digests=set()
+    found=set(files)
+    for directory in scanned():
+        found.update(glob.glob(os.path.join(directory, "**", "*.mpaz"), recursive=True))
+    for file in found:
+        with ZipFile(file) as source:
+            if("reference.json" in source.namelist()):
+                digests.update(json.loads(source.read("reference.json")).values())
+    return digests
+
+def sweep(files):
+    try:
+        digests=referenced(files)
+    except Exception as e:
+        logging.error("Store not swept, failed to read references: "+str(e))
+        return 1
+    removed, size=BlobStore().sweep(digests)
+    print("Swept", removed, "unreferenced blobs,", size, "bytes from", config["store_directory"])
+    return 0
+
+def main():
+    files=[]
+    for target in config["target"] or [config["document_directory"]]:
+        if(os.path.isdir(target)):
+            files.extend(glob.glob(os.path.join(target, "**", "*.mpaz"), recursive=True))
+        else:
+            files.append(target)
+    if(config["sweep"]):
+        outside=[i for i in config["target"] if not inside(i, scanned())]
+        if(outside):
+            print("Cannot sweep the store, not in the document directory or a --scan directory:", ", ".join(outside))
+            return 2
+    jobs=config["jobs"] or os.cpu_count() or 1
+    print("Repacking", len(files), "files with", jobs, "jobs, compression", config["compression"], "level", config["compression_level"])
+    before=0
+    after=0
+    failed=0
+    start=time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn"), initializer=initialize, initargs=(scratch.path(),)) as executor:
+        for future in as_completed([executor.submit(repack, i) for i in files]):
+            file, old, new, error=future.result()
+            if error is None:
+                before=before+old
+                after=after+new
+            else:
+                failed=failed+1
+                logging.error(file+": "+error)
+    elapsed=time.perf_counter()-start
+    print("Repacked", len(files)-failed, "files,", failed, "failed")
+    print("Size", before, "->", after, "bytes, saved", before-after, "bytes ({:.1f}%)".format((before-after)*100/before if before else 0))
+    print("Time {:.2f} s, {:.1f} files/s".format(elapsed, len(files)/elapsed if elapsed else 0))
+    if(config["sweep"] and sweep(files)):
+        failed=failed+1
+    return 1 if failed else 0
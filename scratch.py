@@ -0,0 +1,117 @@
+# MedScript
+# Copyright (C) 2023 Dr. Agnibho Mondal
+# This file is part of MedScript.
+# MedScript is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+# MedScript is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, shutil, tempfile, threading, weakref, atexit, errno
+from config import config
+
+class ScratchDirectory():
+
+    def __init__(self, pool, name):
+        self.name=name
+        self.finalizer=weakref.finalize(self, pool.release, name)
+
+    def cleanup(self):
+        self.finalizer()
+
+class ScratchPool():
+
+    def __init__(self, size=4):
+        self.size=size
+        self.root=None
+        self.owner=True
+        self.count=0
+        self.peak=0
+        self.idle=[]
+        self.active=set()
+        self.lock=threading.RLock()
+
+    def base(self):
+        if(config["scratch_tmpfs"] and os.path.isdir("/dev/shm")):
+            return os.path.join("/dev/shm", "medscript")
+        else:
+            return os.path.join(tempfile.gettempdir(), "medscript")
+
+    def path(self):
+        with self.lock:
+            if self.root is None:
+                os.makedirs(self.base(), exist_ok=True)
+                self.root=tempfile.mkdtemp(dir=self.base())
+            return self.root
+
+    def share(self, root):
+        with self.lock:
+            self.root=root
+            self.owner=False
+
+    def get(self):
+        root=self.path()
+        with self.lock:
+            usage=self.usage(root)
+            self.peak=max(self.peak, usage)
+            if(config["scratch_quota"] and usage>config["scratch_quota"]*1024*1024):
+                raise OSError(errno.ENOSPC, "Scratch space quota exceeded", root)
+            if(self.idle):
+                name=self.idle.pop()
+            else:
+                self.count=self.count+1
+                name=os.path.join(root, str(os.getpid())+"-"+str(self.count))
+                os.mkdir(name)
+            self.active.add(name)
+        return ScratchDirectory(self, name)
+
+    def release(self, name):
+        with self.lock:
+            self.active.discard(name)
+            if not os.path.isdir(name):
+                return
+            self.peak=max(self.peak, self.usage(os.path.dirname(name)))
+            try:
+                if(len(self.idle)<self.size):
+                    for entry in os.scandir(name):
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.unlink(entry.path)
+                    self.idle.append(name)
+                else:
+                    shutil.rmtree(name)
+            except Exception as e:
+                logging.warning(e)
+
+    def usage(self, directory):
+        total=0
+        for path, dirs, files in os.walk(directory):
+            for f in files:
+                try:
+                    total=total+os.lstat(os.path.join(path, f)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def metrics(self):
+        with self.lock:
+            return {"active": len(self.active), "idle": len(self.idle), "bytes": self.usage(self.root) if self.root else 0, "peak": self.peak}
+
+    def cleanup(self):
+        with self.lock:
+            if self.root is not None:
+                if(self.owner):
+                    if(self.count):
+                        logging.info("Scratch space "+str(self.usage(self.root))+" bytes in use at exit, peak usage "+str(self.peak)+" bytes")
+                    shutil.rmtree(self.root, ignore_errors=True)
+                else:
+                    for name in self.idle+list(self.active):
+                        shutil.rmtree(name, ignore_errors=True)
+            self.root=None
+            self.idle=[]
+            self.active.clear()
+
+def initialize(root):
+    scratch.share(root)
+
+scratch=ScratchPool()
+atexit.register(scratch.cleanup)
@@ -47,6 +47,10 @@ class EditConfiguration(QDialog):
             self.input_update.setChecked(bool(self.config["check_update"]))
             self.input_form.setChecked(bool(self.config["enable_form"]))
             self.input_plugin.setChecked(bool(self.config["enable_plugin"]))
+            self.input_store.setChecked(bool(self.config["attachment_store"]))
+            self.input_template_store.setChecked(bool(self.config["template_store"]))
+            self.input_compression.setCurrentText(self.config["compression"])
+            self.input_tmpfs.setChecked(bool(self.config["scratch_tmpfs"]))
             self.input_smime.setChecked(bool(self.config["smime"]))
             self.input_key.setText(self.config["private_key"])
             self.input_certificate.setText(self.config["certificate"])
@@ -67,6 +71,10 @@ class EditConfiguration(QDialog):
                 self.config["check_update"]=self.input_update.isChecked()
                 self.config["enable_form"]=self.input_form.isChecked()
                 self.config["enable_plugin"]=self.input_plugin.isChecked()
+                self.config["attachment_store"]=self.input_store.isChecked()
+                self.config["template_store"]=self.input_template_store.isChecked()
+                self.config["compression"]=self.input_compression.currentText()
+                self.config["scratch_tmpfs"]=self.input_tmpfs.isChecked()
                 self.config["smime"]=self.input_smime.isChecked()
                 self.config["private_key"]=self.input_key.text()
                 self.config["certificate"]=self.input_certificate.text()
@@ -125,6 +133,15 @@ class EditConfiguration(QDialog):
         layout.addRow("Form", self.input_form)
         self.input_plugin=QCheckBox("Enable plugin", self)
         layout.addRow("Plugin", self.input_plugin)
+        self.input_store=QCheckBox("Keep attachments in a shared store", self)
+        layout.addRow("Attachment Store", self.input_store)
+        self.input_template_store=QCheckBox("Keep templates in a shared store", self)
+        layout.addRow("Template Store", self.input_template_store)
+        self.input_compression=QComboBox(self)
+        self.input_compression.addItems(["auto", "deflated", "stored"])
+        layout.addRow("Compression", self.input_compression)
+        self.input_tmpfs=QCheckBox("Keep temporary files in memory (tmpfs)", self)
+        layout.addRow("Temporary Files", self.input_tmpfs)
         self.input_smime=QCheckBox("Enable digital signature (experimental)", self)
         layout.addRow("S/MIME", self.input_smime)
         self.input_key=QLineEdit(self)
@@ -6,8 +6,8 @@
 # You should have received a copy of the GNU General Public License along with MedScript. If not, see <https://www.gnu.org/licenses/>.
 
 import logging, os, sys, datetime, dateutil.parser, shutil, json, copy, threading
-from PyQt6.QtCore import Qt, QDateTime, QDate, QSize, pyqtSignal
-from PyQt6.QtWidgets import QWidget, QMainWindow, QMessageBox, QLabel, QPushButton, QLineEdit, QTextEdit, QDateTimeEdit, QDateEdit, QCalendarWidget, QListWidget, QComboBox, QCheckBox, QRadioButton, QButtonGroup, QVBoxLayout, QHBoxLayout, QFormLayout, QToolBar, QTabWidget, QStatusBar, QFileDialog, QInputDialog, QCompleter, QSizePolicy
+from PyQt6.QtCore import Qt, QDateTime, QDate, QSize, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QMessageBox, QLabel, QPushButton, QLineEdit, QTextEdit, QDateTimeEdit, QDateEdit, QCalendarWidget, QListWidget, QListWidgetItem, QDockWidget, QComboBox, QCheckBox, QRadioButton, QButtonGroup, QVBoxLayout, QHBoxLayout, QFormLayout, QToolBar, QTabWidget, QStatusBar, QFileDialog, QInputDialog, QCompleter, QSizePolicy, QProgressBar
 from PyQt6.QtGui import QAction, QIcon
 from pathlib import Path
 from hashlib import md5
@@ -25,9 +25,11 @@ from editpreset import EditPreset
 from viewbox import ViewBox
 from preset import Preset
 from index import Index
+from cache import cache
 from customform import CustomForm
 from plugin import Plugin
 from installer import Installer
+from scratch import scratch
 
 class MainWindow(QMainWindow):
 
@@ -41,35 +43,50 @@ class MainWindow(QMainWindow):
     plugin=Plugin()
     save_state=md5("".encode()).hexdigest()
     unchanged_state=False
+    task=None
 
     def cmd_new(self):
-        if(self.confirm_close()):
-            self.new_doc()
+        if(self.task is None and self.confirm_close()):
+            return self.new_doc()
+        return False
 
     def cmd_open(self, file=None):
-        if(self.confirm_close()):
+        if(self.task is None and self.confirm_close()):
             try:
                 self.current_file.reset()
                 if(file):
                     self.current_file.set_file(file)
                 else:
                     self.current_file.set_file(QFileDialog.getOpenFileName(self, "Open File", config["document_directory"], "Prescriptions (*.mpaz);; All Files (*)")[0])
-                self.current_file.open()
-                self.prescription.read_from(os.path.join(self.current_file.directory.name,"prescription.json"))
-                self.plugin.open(self.prescription)
-                self.load_interface_from_instance()
-                self.update_instance()
-                self.save_state=md5(self.prescription.get_json().encode()).hexdigest()
-                self.load_attachment(self.current_file.list())
-                self.unchanged_state=True
-            except FileNotFoundError as e:
-                logging.warning(e)
+                self.run_task(self.current_file.open, self.open_finished, self.open_failed)
             except Exception as e:
                 QMessageBox.warning(self,"Open failed", "Failed to open file.")
                 logging.exception(e)
 
+    def open_finished(self, result):
+        try:
+            self.prescription.read_from(os.path.join(self.current_file.directory.name,"prescription.json"))
+            self.plugin.open(self.prescription)
+            self.load_interface_from_instance()
+            self.update_instance()
+            self.save_state=md5(self.prescription.get_json().encode()).hexdigest()
+            self.load_attachment(self.current_file.list())
+            self.unchanged_state=True
+        except FileNotFoundError as e:
+            logging.warning(e)
+        except Exception as e:
+            QMessageBox.warning(self,"Open failed", "Failed to open file.")
+            logging.exception(e)
+
+    def open_failed(self, e):
+        if(not isinstance(e, FileNotFoundError)):
+            QMessageBox.warning(self,"Open failed", "Failed to open file.")
+
     def cmd_copy(self, data):
-        self.cmd_new()
+        if self.task is not None:
+            return
+        if(not self.cmd_new()):
+            return
         self.prescription.set_data_from_json(data)
         self.prescription.id=""
         self.prescription.date=None
@@ -77,6 +94,8 @@ class MainWindow(QMainWindow):
         self.refresh()
 
     def cmd_save(self, save_as=False):
+        if self.task is not None:
+            return
         self.update_instance()
         self.plugin.save(self.prescription)
         if(self.input_template.currentText()!="<unchanged>"):
@@ -96,22 +115,59 @@ class MainWindow(QMainWindow):
                     if(not filename.endswith(".mpaz")):
                        filename=filename+".mpaz"
                     self.current_file.set_file(filename)
-                for i in range(self.input_attachment.count()):
-                    self.current_file.copy(self.input_attachment.item(i).text())
+                attachments=[self.input_attachment.item(i).text() for i in range(self.input_attachment.count())]
                 if(self.prescription.prescriber.get_json()!=self.prescriber.get_json()):
                     if(QMessageBox.StandardButton.Yes==QMessageBox.question(self,"Change Prescriber", "Original Prescriber: "+self.prescription.prescriber.name+"\nCurrent Prescriber: "+self.prescriber.name+"\nReplace original with current?")):
                         self.prescription.prescriber=copy.deepcopy(self.prescriber)
-                self.prescription.write_to(os.path.join(self.current_file.directory.name, "prescription.json"))
                 if change_template:
                     config["template"]=os.path.join(config["template_directory"], template)
-                self.current_file.save(change_template=change_template)
-                self.unchanged_state=False
-                self.load_interface_from_instance()
-                self.save_state=md5(self.prescription.get_json().encode()).hexdigest()
+                self.run_task(self.save_file, self.save_finished, self.save_failed, attachments, copy.deepcopy(self.prescription), change_template)
             except Exception as e:
                 QMessageBox.warning(self,"Save failed", "Failed to save file.")
                 logging.exception(e)
 
+    def save_file(self, attachments, prescription, change_template, progress=None):
+        for i in attachments:
+            self.current_file.copy(i)
+        prescription.write_to(os.path.join(self.current_file.directory.name, "prescription.json"))
+        self.current_file.save(change_template=change_template, progress=progress)
+        return prescription
+
+    def save_finished(self, prescription):
+        self.prescription.file=prescription.file
+        self.unchanged_state=False
+        self.load_interface_from_instance()
+        self.save_state=md5(self.prescription.get_json().encode()).hexdigest()
+
+    def save_failed(self, e):
+        QMessageBox.warning(self,"Save failed", "Failed to save file.")
+
+    def run_task(self, function, finished, failed, *args):
+        self.task=Task(function, *args)
+        self.task.signals.progress.connect(self.show_progress)
+        self.task.signals.finished.connect(self.task_done)
+        self.task.signals.failed.connect(self.task_done)
+        self.task.signals.finished.connect(finished)
+        self.task.signals.failed.connect(failed)
+        self.set_busy(True)
+        QThreadPool.globalInstance().start(self.task)
+
+    def task_done(self):
+        self.task=None
+        self.set_busy(False)
+
+    def set_busy(self, busy):
+        self.centralWidget().setEnabled(not busy)
+        self.menuBar().setEnabled(not busy)
+        self.toolbar.setEnabled(not busy)
+        self.dock_history.setEnabled(not busy)
+        self.progress.setRange(0, 0)
+        self.progress.setVisible(busy)
+
+    def show_progress(self, done, total):
+        self.progress.setRange(0, total)
+        self.progress.setValue(done)
+
     def cmd_save_as(self):
         suggest=self.prescription.id if(self.prescription.id) else self.prescription.name
         suggest=os.path.abspath(os.path.join(config["document_directory"], suggest)+".mpaz")
@@ -123,10 +179,31 @@ class MainWindow(QMainWindow):
             Path(self.current_file.file).touch()
             self.cmd_save(save_as=True)
 
+    def cmd_export(self):
+        if self.task is not None:
+            return
+        self.update_instance()
+        if(self.save_state==md5(self.prescription.get_json().encode()).hexdigest() and os.path.exists(self.current_file.file)):
+            suggest=os.path.splitext(self.current_file.file)[0]+"-export.mpaz"
+            filename=QFileDialog.getSaveFileName(self, "Export File", suggest, "Prescriptions (*.mpaz);; All Files (*)")[0]
+            if(len(filename)>0):
+                if not filename.endswith(".mpaz"):
+                    filename=filename+".mpaz"
+                self.run_task(self.current_file.export, self.export_finished, self.export_failed, filename)
+        else:
+           QMessageBox.information(self, "Save first", "Please save the file before exporting.")
+
+    def export_finished(self, result):
+        self.statusbar.showMessage("Export complete", 5000)
+
+    def export_failed(self, e):
+        QMessageBox.warning(self,"Export failed", "Failed to export file.")
+
     def cmd_refresh(self):
         self.refresh()
 
     def cmd_quit(self):
+        self.wait_task()
         if(self.confirm_close()):
             sys.exit()
 
@@ -135,9 +212,12 @@ class MainWindow(QMainWindow):
         self.unrenderbox.show(self.prescription).exec()
 
     def cmd_render(self):
+        if self.task is not None:
+            return
         self.update_instance()
         if(self.save_state==md5(self.prescription.get_json().encode()).hexdigest()):
             try:
+                self.current_file.extract("template/")
                 target=self.renderer.render(self.current_file.directory.name)
                 if target is not None:
                     self.signal_view.emit(target)
@@ -209,6 +289,26 @@ class MainWindow(QMainWindow):
     def cmd_index(self):
         self.index.show()
 
+    def cmd_history(self):
+        self.dock_history.setVisible(not self.dock_history.isVisible())
+
+    def cmd_view_history(self):
+        try:
+            item=self.input_history.currentItem()
+            if item is not None:
+                self.unrenderbox.show(cache.get(item.data(Qt.ItemDataRole.UserRole))).exec()
+        except Exception as e:
+            logging.exception(e)
+
+    def cmd_open_history(self):
+        item=self.input_history.currentItem()
+        if item is not None:
+            self.cmd_open(item.data(Qt.ItemDataRole.UserRole))
+
+    def cmd_copy_last(self):
+        if self.history_last is not None:
+            self.cmd_copy(copy.deepcopy(self.history_last))
+
     def cmd_configuration(self):
         self.editConfiguration.exec()
 
@@ -334,6 +434,7 @@ class MainWindow(QMainWindow):
             file_msg=self.current_file.file if self.current_file.file else "New file"
             sign_msg="(signed)" if config["smime"] and self.current_file.is_signed() else ""
             self.statusbar.showMessage(file_msg+" "+sign_msg)
+            self.show_scratch()
             if date is None:
                 d=QDateTime.currentDateTime()
             else:
@@ -346,6 +447,7 @@ class MainWindow(QMainWindow):
             self.input_date.setDateTime(d)
             self.input_id.setText(id)
             self.input_pid.setText(pid)
+            self.history_timer.start()
             self.input_name.setText(name)
             try:
                 pdate=dateutil.parser.parse(dob)
@@ -441,7 +543,12 @@ class MainWindow(QMainWindow):
             logging.error(e)
 
     def new_doc(self):
-        self.current_file.reset()
+        try:
+            self.current_file.reset()
+        except OSError as e:
+            QMessageBox.warning(self,"Failed", "Failed to create new prescription. Please check console for more info.")
+            logging.exception(e)
+            return False
         self.prescription.set_data()
         self.input_attachment.clear()
         self.load_interface()
@@ -452,6 +559,7 @@ class MainWindow(QMainWindow):
             self.btnAge.click()
             self.update_instance()
         self.save_state=md5(self.prescription.get_json().encode()).hexdigest()
+        return True
 
     def change_prescriber(self, file):
         self.prescription.reload_prescriber(file)
@@ -462,6 +570,11 @@ class MainWindow(QMainWindow):
         self.editPrescriber.load(file)
         self.editPrescriber.exec()
 
+    def show_scratch(self):
+        metrics=scratch.metrics()
+        self.label_scratch.setText("Temporary files: {:.1f} MiB (peak {:.1f} MiB)".format(metrics["bytes"]/1048576, metrics["peak"]/1048576))
+        self.label_scratch.setToolTip(str(metrics["active"])+" directories in use, "+str(metrics["idle"])+" kept for reuse")
+
     def refresh(self):
         self.update_instance()
         self.plugin.refresh(self.prescription)
@@ -486,9 +599,26 @@ class MainWindow(QMainWindow):
 
     def save_attachment(self):
         try:
-            shutil.copyfile(self.input_attachment.currentItem().text(), QFileDialog.getSaveFileName(self, "Save Attachment", os.path.join(config["document_directory"], os.path.basename(self.input_attachment.currentItem().text())))[0])
+            shutil.copyfile(self.current_file.fetch(self.input_attachment.currentItem().text()), QFileDialog.getSaveFileName(self, "Save Attachment", os.path.join(config["document_directory"], os.path.basename(self.input_attachment.currentItem().text())))[0])
+        except Exception as e:
+            logging.exception(e)
+
+    def load_history(self):
+        try:
+            self.input_history.clear()
+            self.history_last=None
+            rows=[row for row in self.index.store.history(self.input_pid.text().strip(), 50) if row[-1]!=self.current_file.file]
+            for row in rows:
+                item=QListWidgetItem(row[6]+"\n"+row[1]+" "+row[7])
+                item.setData(Qt.ItemDataRole.UserRole, row[-1])
+                item.setToolTip(row[-1])
+                self.input_history.addItem(item)
+            if(rows):
+                self.history_last=cache.get(rows[0][-1])
+                cache.prefetch([row[-1] for row in rows[1:10]])
         except Exception as e:
             logging.exception(e)
+        self.button_copy_last.setEnabled(self.history_last is not None)
 
     def load_attachment(self, attachments):
         for attach in attachments:
@@ -530,7 +660,12 @@ class MainWindow(QMainWindow):
         flag=(self.save_state==md5(self.prescription.get_json().encode()).hexdigest() or QMessageBox.StandardButton.Yes==QMessageBox.question(self,"Confirm action", "Unsaved changes may be lost. Continue?"))
         return flag
 
+    def wait_task(self):
+        QThreadPool.globalInstance().waitForDone()
+        QApplication.processEvents()
+
     def closeEvent(self, event):
+        self.wait_task()
         if(self.confirm_close()):
             event.accept()
         else:
@@ -552,6 +687,12 @@ class MainWindow(QMainWindow):
 
         self.load_presets()
 
+        self.history_last=None
+        self.history_timer=QTimer(self)
+        self.history_timer.setSingleShot(True)
+        self.history_timer.setInterval(200)
+        self.history_timer.timeout.connect(self.load_history)
+
         action_new=QAction("New File", self)
         action_new.setShortcut("Ctrl+N")
         action_new.triggered.connect(self.cmd_new)
@@ -576,6 +717,8 @@ class MainWindow(QMainWindow):
         action_quit=QAction("Quit MedScript", self)
         action_quit.setShortcut("Ctrl+Q")
         action_quit.triggered.connect(self.cmd_quit)
+        action_export=QAction("Export", self)
+        action_export.triggered.connect(self.cmd_export)
         action_render=QAction("Render Prescription", self)
         action_render.setShortcut("Ctrl+R")
         action_render2=QAction(icon_render, "Render", self)
@@ -605,6 +748,9 @@ class MainWindow(QMainWindow):
         action_index.setShortcut("Ctrl+I")
         action_index2=QAction(icon_index, "Index", self)
         action_index2.triggered.connect(self.cmd_index)
+        action_history=QAction("Show History", self)
+        action_history.setShortcut("Ctrl+H")
+        action_history.triggered.connect(self.cmd_history)
         action_update=QAction("Check Update", self)
         action_update.triggered.connect(self.cmd_update)
         action_about=QAction("About MedScript", self)
@@ -616,10 +762,12 @@ class MainWindow(QMainWindow):
         menubar=self.menuBar()
         menu_file=menubar.addMenu("File")
         menu_file.addAction(action_index)
+        menu_file.addAction(action_history)
         menu_file.addAction(action_new)
         menu_file.addAction(action_open)
         menu_file.addAction(action_save)
         menu_file.addAction(action_save_as)
+        menu_file.addAction(action_export)
         menu_file.addAction(action_quit)
         menu_prepare=menubar.addMenu("Process")
         menu_prepare.addAction(action_unrender)
@@ -655,6 +803,7 @@ class MainWindow(QMainWindow):
         menu_help.addAction(action_help)
 
         toolbar=QToolBar("Main Toolbar", floatable=False, movable=False)
+        self.toolbar=toolbar
         toolbar.setIconSize(QSize(16, 16))
         toolbar.addAction(action_index2)
         toolbar.addAction(action_open2)
@@ -693,6 +842,7 @@ class MainWindow(QMainWindow):
         self.input_id=QLineEdit(self)
         layout_info.addRow("Prescription ID", self.input_id)
         self.input_pid=QLineEdit(self)
+        self.input_pid.textChanged.connect(self.history_timer.start)
         layout_info.addRow("Patient ID", self.input_pid)
         self.input_name=QLineEdit(self)
         layout_info.addRow("Name", self.input_name)
@@ -924,8 +1074,35 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(tab)
 
+        widget_history=QWidget(self)
+        layout_history=QVBoxLayout(widget_history)
+        layout_history2=QHBoxLayout()
+        self.input_history=QListWidget(self)
+        self.input_history.doubleClicked.connect(self.cmd_view_history)
+        button_view_history=QPushButton("View")
+        button_view_history.clicked.connect(self.cmd_view_history)
+        button_open_history=QPushButton("Open")
+        button_open_history.clicked.connect(self.cmd_open_history)
+        self.button_copy_last=QPushButton("Copy Last Visit")
+        self.button_copy_last.setEnabled(False)
+        self.button_copy_last.clicked.connect(self.cmd_copy_last)
+        layout_history2.addWidget(button_view_history)
+        layout_history2.addWidget(button_open_history)
+        layout_history.addWidget(self.input_history)
+        layout_history.addLayout(layout_history2)
+        layout_history.addWidget(self.button_copy_last)
+        self.dock_history=QDockWidget("Previous Visits", self)
+        self.dock_history.setWidget(widget_history)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.dock_history)
+
         self.statusbar=QStatusBar()
         self.setStatusBar(self.statusbar)
+        self.progress=QProgressBar()
+        self.progress.setMaximumWidth(200)
+        self.progress.hide()
+        self.statusbar.addPermanentWidget(self.progress)
+        self.label_scratch=QLabel()
+        self.statusbar.addPermanentWidget(self.label_scratch)
 
         self.renderbox=RenderBox()
         self.unrenderbox=UnrenderBox()
@@ -943,6 +1120,7 @@ class MainWindow(QMainWindow):
         self.installer=Installer()
         self.index.signal_open.connect(self.cmd_open)
         self.index.signal_copy.connect(self.cmd_copy)
+        self.index.signal_change.connect(self.load_history)
         self.plugin.update.connect(lambda: self.load_interface_from_instance())
         self.signal_update.connect(self.show_update)
 
@@ -959,3 +1137,28 @@ class MainWindow(QMainWindow):
 
         self.setWindowIcon(QIcon(os.path.join(config["resource"], "icon_medscript.ico")))
         self.showMaximized()
+
+class TaskSignals(QObject):
+
+    progress=pyqtSignal(int, int)
+    finished=pyqtSignal(object)
+    failed=pyqtSignal(object)
+
+class Task(QRunnable):
+
+    def __init__(self, function, *args):
+        super().__init__()
+        self.function=function
+        self.args=args
+        self.signals=TaskSignals()
+
+    def run(self):
+        try:
+            result=self.function(*self.args, progress=self.signals.progress.emit)
+            self.signals.finished.emit(result)
+        except FileNotFoundError as e:
+            logging.warning(e)
+            self.signals.failed.emit(e)
+        except Exception as e:
+            logging.exception(e)
+            self.signals.failed.emit(e)